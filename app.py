@@ -1,14 +1,45 @@
+import io
 import os
 import re
+import sys
+import json
+import math
+import time
+import zlib
+import uuid
+import random
+import shutil
+import subprocess
+import zipfile
+import threading
+import multiprocessing
+import click
 import mysql.connector
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, send_from_directory, jsonify
+    session, flash, send_from_directory, jsonify,
+    Response, stream_template, get_flashed_messages, g
 )
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
+# Optional: brotli is preferred over gzip when the client accepts it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional: redis shares rate-limit buckets between app processes
+try:
+    import redis
+except ImportError:
+    redis = None
+
 app = Flask(__name__)
 
 # ---------------------------------------------------
@@ -22,6 +53,21 @@ MYSQL_USER = os.environ.get("MYSQL_USER", "root")
 MYSQL_PASS = os.environ.get("MYSQL_PASS", "")
 MYSQL_DB   = os.environ.get("MYSQL_DB", "socialdb")
 
+# Optional user-id sharding for `messages` and `likes` (see README). Without a
+# shard map there is a single logical shard living in MYSQL_DB.
+SHARD_MAP_FILE       = os.environ.get("SHARD_MAP_FILE")
+SHARD_MAP_TTL        = int(os.environ.get("SHARD_MAP_TTL", 5))
+SHARD_FREEZE_WAIT    = int(os.environ.get("SHARD_FREEZE_WAIT", 10))
+SHARD_FANOUT_WORKERS = int(os.environ.get("SHARD_FANOUT_WORKERS", 8))
+
+# Monthly partitions for messages; months older than HOT_HISTORY_MONTHS are
+# moved (messages and comments) into compressed *_archive tables
+HOT_HISTORY_MONTHS  = int(os.environ.get("HOT_HISTORY_MONTHS", 6))
+PARTITIONS_AHEAD    = 2
+ARCHIVE_INTERVAL    = int(os.environ.get("ARCHIVE_INTERVAL", 6 * 3600))
+ARCHIVE_BATCH       = int(os.environ.get("ARCHIVE_BATCH", 5000))
+MESSAGES_PAGE_SIZE  = int(os.environ.get("MESSAGES_PAGE_SIZE", 50))
+
 BAD_WORDS_FILE = "bad_words.txt"
 MAX_WORDS      = 50
 
@@ -29,6 +75,106 @@ UPLOAD_FOLDER = os.path.join("static", "uploads")
 ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".mp4", ".mov", ".avi"}
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
+# Resumable chunked uploads (large videos); partial files live outside static/
+UPLOAD_TMP_FOLDER   = os.environ.get("UPLOAD_TMP_FOLDER", "upload_parts")
+MAX_UPLOAD_SIZE     = int(os.environ.get("MAX_UPLOAD_SIZE", 512 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE   = int(os.environ.get("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+UPLOAD_READ_SIZE    = 64 * 1024
+UPLOAD_SESSION_TTL  = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+UPLOAD_CLEANUP_INTERVAL = int(os.environ.get("UPLOAD_CLEANUP_INTERVAL", 3600))
+
+# Video transcoding to adaptive HLS renditions (needs ffmpeg/ffprobe on PATH)
+VIDEO_EXTENSIONS   = {".mp4", ".mov", ".avi"}
+HLS_FOLDER         = os.path.join(UPLOAD_FOLDER, "hls")
+TRANSCODE_WORKERS  = int(os.environ.get("TRANSCODE_WORKERS", 2))
+TRANSCODE_TIMEOUT  = int(os.environ.get("TRANSCODE_TIMEOUT", 1800))
+HLS_SEGMENT_SECONDS = 6
+# hls.js for browsers without native HLS; pinned, deferred and loaded only on
+# pages with video. HLS_JS_INTEGRITY is its SRI hash, "sha384-" followed by
+#   curl -sL $HLS_JS_URL | openssl dgst -sha384 -binary | openssl base64 -A
+HLS_JS_URL       = os.environ.get("HLS_JS_URL",
+                                  "https://cdn.jsdelivr.net/npm/hls.js@1.5.13/dist/hls.min.js")
+HLS_JS_INTEGRITY = os.environ.get("HLS_JS_INTEGRITY", "")
+# (height, video bitrate, audio bitrate)
+TRANSCODE_RENDITIONS = [
+    (360,  "800k",  "96k"),
+    (720,  "2800k", "128k"),
+    (1080, "5000k", "192k"),
+]
+
+# Stream large pages (feed, profile) while rows are still being fetched
+STREAM_TEMPLATES   = os.environ.get("STREAM_TEMPLATES", "1") == "1"
+STREAM_CHUNK_SIZE  = int(os.environ.get("STREAM_CHUNK_SIZE", 8192))
+STREAM_BATCH_SIZE  = int(os.environ.get("STREAM_BATCH_SIZE", 20))
+
+# Negotiated gzip/brotli compression for HTML and JSON responses
+COMPRESS_MIMETYPES = {"text/html", "application/json"}
+COMPRESS_MIN_SIZE  = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+GZIP_LEVEL         = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY     = int(os.environ.get("BROTLI_QUALITY", 5))
+
+# Explore ranking: time-decayed engagement score per post
+EXPLORE_PAGE_SIZE        = int(os.environ.get("EXPLORE_PAGE_SIZE", 20))
+EXPLORE_HALF_LIFE_HOURS  = float(os.environ.get("EXPLORE_HALF_LIFE_HOURS", 24))
+EXPLORE_RESCORE_INTERVAL = int(os.environ.get("EXPLORE_RESCORE_INTERVAL", 900))
+EXPLORE_RESCORE_BATCH    = int(os.environ.get("EXPLORE_RESCORE_BATCH", 1000))
+EXPLORE_MIN_SCORE        = float(os.environ.get("EXPLORE_MIN_SCORE", 0.01))
+POST_BASE_SCORE = 1.0
+LIKE_WEIGHT     = 1.0
+SAVE_WEIGHT     = 2.0
+COMMENT_WEIGHT  = 3.0
+
+# Follow graph
+FOLLOW_PAGE_SIZE       = int(os.environ.get("FOLLOW_PAGE_SIZE", 50))
+SUGGESTIONS_PER_USER   = int(os.environ.get("SUGGESTIONS_PER_USER", 10))
+SUGGESTIONS_BATCH      = int(os.environ.get("SUGGESTIONS_BATCH", 200))
+SUGGESTIONS_INTERVAL   = int(os.environ.get("SUGGESTIONS_INTERVAL", 3600))
+
+# Per-user data export (ZIP of NDJSON files + media); big accounts are built
+# in the background and downloaded later
+EXPORT_FOLDER          = os.environ.get("EXPORT_FOLDER", "exports")
+EXPORT_FETCH_SIZE      = int(os.environ.get("EXPORT_FETCH_SIZE", 500))
+EXPORT_CHUNK_SIZE      = int(os.environ.get("EXPORT_CHUNK_SIZE", 256 * 1024))
+EXPORT_INLINE_MAX_ROWS = int(os.environ.get("EXPORT_INLINE_MAX_ROWS", 5000))
+EXPORT_WORKERS         = int(os.environ.get("EXPORT_WORKERS", 2))
+EXPORT_TTL             = int(os.environ.get("EXPORT_TTL", 48 * 3600))
+# pending/running jobs older than this were lost (restart/crash) and count as failed
+EXPORT_STALE_AFTER     = int(os.environ.get("EXPORT_STALE_AFTER", 2 * 3600))
+
+# Admin sampling profiler: stack samples + SQL timings for a fraction of
+# requests (or one endpoint for a while). Per process, off by default.
+PROFILE_SAMPLE_RATE  = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS      = float(os.environ.get("PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL     = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_MAX_ACTIVE   = int(os.environ.get("PROFILE_MAX_ACTIVE", 4))
+PROFILE_MAX_CAPTURES = int(os.environ.get("PROFILE_MAX_CAPTURES", 200))
+PROFILE_MAX_SQL      = int(os.environ.get("PROFILE_MAX_SQL", 500))
+PROFILE_SQL_MAX_LEN  = 1000
+PROFILE_MAX_DEPTH    = 128
+
+# Token-bucket rate limits on write APIs and login, "requests/seconds" per
+# endpoint (override with RATE_LIMIT_<ENDPOINT>, "off" disables). Buckets are
+# per process unless RATE_LIMIT_REDIS_URL points at a shared redis.
+RATE_LIMIT_ENABLED   = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_MAX_KEYS  = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_DEFAULTS  = {
+    "like_api":        "60/60",
+    "save_api":        "30/60",
+    "add_comment_api": "20/60",
+    "direct_messages": "30/60",
+    "login":           "10/300",
+    # failed logins per username, from all clients together; must stay well
+    # above one client's login rate so a single IP can't lock the owner out
+    "login_name":      "100/300",
+}
+
+# Reverse proxies (ingress, load balancer) in front of the app, so that
+# request.remote_addr is the client address used for per-IP limits
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # ---------------------------------------------------
 # OFFENSIVE WORDS
 # ---------------------------------------------------
@@ -64,15 +210,186 @@ def censor_offensive(text):
 # ---------------------------------------------------
 # DB UTIL
 # ---------------------------------------------------
-def get_db_connection(database=None):
+def get_db_connection(database=None, shard=None, for_write=False, **kwargs):
+    """
+    Connects to the main database, or with `shard` set, to the host currently
+    holding that logical shard. `for_write` waits out a shard move in progress.
+    """
+    if shard is None:
+        conn = mysql.connector.connect(
+            host=MYSQL_HOST,
+            port=MYSQL_PORT,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            database=database,
+            **kwargs
+        )
+    else:
+        host_name = _route_shard(shard, for_write)
+        conn = connect_shard_host(host_name, shard_database(shard), **kwargs)
+    # statements of a sampled request are timed (see REQUEST PROFILER)
+    prof = _active_profiles.get(threading.get_ident())
+    return _ProfiledConnection(conn, prof) if prof else conn
+
+# ---------------------------------------------------
+# SHARD ROUTING
+# ---------------------------------------------------
+class ShardUnavailable(Exception):
+    pass
+
+def load_shard_config():
+    """
+    Reads SHARD_MAP_FILE, e.g.
+    {"logical_shards": 4,
+     "hosts":  {"a": {"host": "127.0.0.1", "port": 3307}, "b": {"host": "127.0.0.1", "port": 3308}},
+     "shards": {"0": "a", "1": "a", "2": "b", "3": "b"}}
+    """
+    if not SHARD_MAP_FILE:
+        return None
+    with open(SHARD_MAP_FILE, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    missing = [n for n in range(cfg["logical_shards"]) if str(n) not in cfg["shards"]]
+    if missing:
+        raise ValueError(f"{SHARD_MAP_FILE}: no host for shards {missing}")
+    return cfg
+
+SHARD_CONFIG   = load_shard_config()
+LOGICAL_SHARDS = SHARD_CONFIG["logical_shards"] if SHARD_CONFIG else 1
+_shard_map_cache = {"loaded_at": 0.0, "map": None}
+_shard_pool = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS)
+
+def shard_for_user(user_id):
+    return int(user_id) % LOGICAL_SHARDS
+
+def all_shards():
+    return list(range(LOGICAL_SHARDS))
+
+def shard_database(shard):
+    return f"{MYSQL_DB}_s{shard}" if SHARD_CONFIG else MYSQL_DB
+
+def connect_shard_host(host_name, database, **kwargs):
+    # a raw connection: get_db_connection() adds profiling on top, exactly once
+    if SHARD_CONFIG:
+        h = SHARD_CONFIG["hosts"][host_name]
+    else:
+        h = {"host": MYSQL_HOST, "port": MYSQL_PORT}
     return mysql.connector.connect(
-        host=MYSQL_HOST,
-        port=MYSQL_PORT,
-        user=MYSQL_USER,
-        password=MYSQL_PASS,
-        database=database
+        host=h["host"],
+        port=int(h.get("port", 3306)),
+        user=h.get("user", MYSQL_USER),
+        password=h.get("password", MYSQL_PASS),
+        database=database,
+        **kwargs
     )
 
+def get_shard_map(refresh=False):
+    """
+    Returns {shard: (host_name, state)}. Moves recorded in the `shard_map` table
+    override the config file; the result is cached for SHARD_MAP_TTL seconds.
+    """
+    if not SHARD_CONFIG:
+        return {0: (None, "active")}
+    cached = _shard_map_cache["map"]
+    if cached and not refresh and time.monotonic() - _shard_map_cache["loaded_at"] < SHARD_MAP_TTL:
+        return cached
+
+    shard_map = {int(k): (v, "active") for k, v in SHARD_CONFIG["shards"].items()}
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("SELECT shard, host_name, state FROM shard_map")
+    for shard, host_name, state in cur.fetchall():
+        shard_map[shard] = (host_name, state)
+    cur.close()
+    conn.close()
+    _shard_map_cache["map"] = shard_map
+    _shard_map_cache["loaded_at"] = time.monotonic()
+    return shard_map
+
+def _route_shard(shard, for_write):
+    host_name, state = get_shard_map()[shard]
+    if not for_write or state != "frozen":
+        return host_name
+    # writes wait for an in-progress move to flip the shard to its new host
+    deadline = time.monotonic() + SHARD_FREEZE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        host_name, state = get_shard_map(refresh=True)[shard]
+        if state != "frozen":
+            return host_name
+    raise ShardUnavailable(f"shard {shard} is being moved")
+
+def shard_query(shard, query, params=()):
+    conn = get_db_connection(shard=shard)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return rows
+
+def scatter_gather(fn, shards):
+    """Runs fn(shard) for every shard concurrently and returns {shard: result}."""
+    shards = list(shards)
+    if len(shards) <= 1:
+        return {s: fn(s) for s in shards}
+    prof = _active_profiles.get(threading.get_ident())
+    futures = {s: _shard_pool.submit(_profiled_call, prof, fn, s) for s in shards}
+    return {s: f.result() for s, f in futures.items()}
+
+def like_stats(posts, user_id=None):
+    """
+    Returns {post_id: (like_count, user_has_liked)} for post dicts carrying `id`
+    and `user_id`. Likes live on the post author's shard, so this is one grouped
+    query per shard touched, run in parallel.
+    """
+    by_shard = {}
+    for p in posts:
+        by_shard.setdefault(shard_for_user(p["user_id"]), []).append(p["id"])
+
+    def fetch(shard):
+        ids = by_shard[shard]
+        placeholders = ",".join(["%s"] * len(ids))
+        return shard_query(shard, f"""
+            SELECT post_id, COUNT(*) AS c, SUM(user_id=%s) AS mine
+            FROM likes
+            WHERE post_id IN ({placeholders})
+            GROUP BY post_id
+        """, (user_id or 0, *ids))
+
+    stats = {}
+    for rows in scatter_gather(fetch, by_shard).values():
+        for r in rows:
+            stats[r["post_id"]] = (r["c"], bool(r["mine"]))
+    return stats
+
+def stream_rows(query, params=(), shard=None, fetch_size=STREAM_BATCH_SIZE):
+    """
+    Yields rows from an unbuffered (server-side) cursor on its own connection,
+    `fetch_size` at a time, so callers never hold the full result set in memory.
+    """
+    conn = get_db_connection(MYSQL_DB, shard=shard, consume_results=True)
+    cur  = conn.cursor(dictionary=True)
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+        conn.close()
+
+def iter_batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def init_db():
     """
     Creates the `socialdb` if not exists, ensures tables exist with ON DELETE CASCADE for comments->posts.
@@ -119,14 +436,6 @@ def init_db():
             FOREIGN KEY(user_id) REFERENCES users(id)
         ) ENGINE=InnoDB
     """)
-    # likes
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS likes (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            post_id INT NOT NULL,
-            user_id INT NOT NULL
-        ) ENGINE=InnoDB
-    """)
     # saved_posts
     cur.execute("""
         CREATE TABLE IF NOT EXISTS saved_posts (
@@ -135,16 +444,6 @@ def init_db():
             post_id INT NOT NULL
         ) ENGINE=InnoDB
     """)
-    # messages
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            sender_id INT NOT NULL,
-            recipient_id INT NOT NULL,
-            content TEXT NOT NULL,
-            created_at DATETIME NOT NULL
-        ) ENGINE=InnoDB
-    """)
     # comments with ON DELETE CASCADE
     cur.execute("""
         CREATE TABLE IF NOT EXISTS comments (
@@ -157,6 +456,20 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(id)
         ) ENGINE=InnoDB
     """)
+    ensure_index(cur, "comments", "idx_comments_created", "(created_at)")
+    # cold comments, moved by archive_cold_history()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS comments_archive (
+            id INT NOT NULL PRIMARY KEY,
+            post_id INT NOT NULL,
+            user_id INT NOT NULL,
+            content TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            INDEX idx_comments_archive_post (post_id, created_at),
+            INDEX idx_comments_archive_user (user_id)
+        ) ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+    """)
+    ensure_index(cur, "comments_archive", "idx_comments_archive_user", "(user_id)")
     # follows
     cur.execute("""
         CREATE TABLE IF NOT EXISTS follows (
@@ -164,10 +477,51 @@ def init_db():
             followee_id INT NOT NULL,
             created_at DATETIME NOT NULL,
             PRIMARY KEY(follower_id, followee_id),
+            INDEX idx_follows_followee (followee_id, created_at),
+            INDEX idx_follows_follower_created (follower_id, created_at),
             FOREIGN KEY(follower_id) REFERENCES users(id),
             FOREIGN KEY(followee_id) REFERENCES users(id)
         ) ENGINE=InnoDB
     """)
+    # reverse indexes for databases created before they were declared above
+    ensure_index(cur, "follows", "idx_follows_followee", "(followee_id, created_at)")
+    ensure_index(cur, "follows", "idx_follows_follower_created", "(follower_id, created_at)")
+    # upload_sessions: resumable uploads ('open' -> 'finalized' -> 'attached')
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id CHAR(32) PRIMARY KEY,
+            user_id INT NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            total_size BIGINT NOT NULL,
+            received BIGINT NOT NULL DEFAULT 0,
+            status VARCHAR(16) NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            INDEX idx_upload_sessions_status (status, updated_at),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) ENGINE=InnoDB
+    """)
+    # user_counts: cached follower/following counters, updated on write
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_counts (
+            user_id INT PRIMARY KEY,
+            follower_count INT NOT NULL DEFAULT 0,
+            following_count INT NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB
+    """)
+    # one-time backfill for follows made before the counters existed
+    cur.execute("SELECT 1 FROM user_counts LIMIT 1")
+    if not cur.fetchone():
+        recount_follow_counts(cur)
+    # follow_suggestions: friends-of-friends, filled by a batch job
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS follow_suggestions (
+            user_id INT NOT NULL,
+            suggested_id INT NOT NULL,
+            mutuals INT NOT NULL,
+            PRIMARY KEY(user_id, suggested_id)
+        ) ENGINE=InnoDB
+    """)
     # notifications
     cur.execute("""
         CREATE TABLE IF NOT EXISTS notifications (
@@ -179,11 +533,209 @@ def init_db():
             FOREIGN KEY(user_id) REFERENCES users(id)
         ) ENGINE=InnoDB
     """)
+    # shard_map: shard moves recorded by `flask move-shard`
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS shard_map (
+            shard INT PRIMARY KEY,
+            host_name VARCHAR(64) NOT NULL,
+            state VARCHAR(16) NOT NULL,
+            updated_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+    """)
+    # post_scores: ranked index for the Explore feed
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS post_scores (
+            post_id INT PRIMARY KEY,
+            score DOUBLE NOT NULL,
+            decayed_at DATETIME NOT NULL,
+            INDEX idx_post_scores_score (score)
+        ) ENGINE=InnoDB
+    """)
+    # export_jobs: background data exports ('pending' -> 'running' -> 'ready'/'failed')
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id CHAR(32) PRIMARY KEY,
+            user_id INT NOT NULL,
+            requested_by INT NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            created_at DATETIME NOT NULL,
+            finished_at DATETIME,
+            INDEX idx_export_jobs_created (created_at),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) ENGINE=InnoDB
+    """)
+
+    if not SHARD_CONFIG:
+        # the single logical shard lives in the main database
+        init_shard_tables(cur)
+    leftovers = unsharded_tables_with_rows(cur) if SHARD_CONFIG else []
+
+    conn.commit()
+    cur.close()
+    conn.close()
+    if leftovers:
+        raise RuntimeError(f"{MYSQL_DB} still holds unsharded rows in {', '.join(leftovers)}; "
+                           "run `flask shard-init` once to copy them onto the shards")
+
+    # Step C: sharded tables on every shard host
+    if SHARD_CONFIG:
+        for shard, (host_name, _) in get_shard_map(refresh=True).items():
+            create_shard_database(host_name, shard)
 
+def create_shard_database(host_name, shard):
+    conn = connect_shard_host(host_name, None)
+    cur  = conn.cursor()
+    cur.execute(f"CREATE DATABASE IF NOT EXISTS {shard_database(shard)}")
+    cur.execute(f"USE {shard_database(shard)}")
+    init_shard_tables(cur)
     conn.commit()
     cur.close()
     conn.close()
 
+def init_shard_tables(cur):
+    """
+    Tables partitioned by user id. Each message is stored once per participant
+    (owner_id) so a conversation is read from a single shard; likes live on the
+    shard of the post's author.
+    """
+    # likes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS likes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            post_id INT NOT NULL,
+            user_id INT NOT NULL,
+            INDEX idx_likes_post_user (post_id, user_id),
+            INDEX idx_likes_user (user_id)
+        ) ENGINE=InnoDB
+    """)
+    ensure_index(cur, "likes", "idx_likes_post_user", "(post_id, user_id)")
+    ensure_index(cur, "likes", "idx_likes_user", "(user_id)")
+    # messages, range-partitioned by month (the partition key must be in the PK)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INT AUTO_INCREMENT,
+            owner_id INT NOT NULL,
+            peer_id INT NOT NULL,
+            sender_id INT NOT NULL,
+            recipient_id INT NOT NULL,
+            content TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (id, created_at),
+            INDEX idx_messages_conversation (owner_id, peer_id, created_at)
+        ) ENGINE=InnoDB
+        {_month_partitions_clause(datetime.now())}
+    """)
+    if not column_exists(cur, "messages", "owner_id"):
+        _migrate_messages_to_owner_copies(cur)
+    if not message_partitions(cur):
+        _partition_existing_messages(cur)
+    # cold history, compressed and no longer partitioned
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS messages_archive (
+            id INT NOT NULL PRIMARY KEY,
+            owner_id INT NOT NULL,
+            peer_id INT NOT NULL,
+            sender_id INT NOT NULL,
+            recipient_id INT NOT NULL,
+            content TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            INDEX idx_messages_archive_conversation (owner_id, peer_id, created_at)
+        ) ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+    """)
+
+def _month_start(d):
+    return d.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _add_months(d, n):
+    years, month0 = divmod(d.month - 1 + n, 12)
+    return d.replace(year=d.year + years, month=month0 + 1, day=1)
+
+def _partition_defs(first_month, last_month):
+    defs = []
+    month = _month_start(first_month)
+    while month <= last_month:
+        nxt = _add_months(month, 1)
+        defs.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{nxt:%Y-%m-%d}')")
+        month = nxt
+    return defs
+
+def _month_partitions_clause(first_month):
+    defs = _partition_defs(first_month, _add_months(_month_start(datetime.now()), PARTITIONS_AHEAD))
+    defs.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return "PARTITION BY RANGE COLUMNS(created_at) (" + ", ".join(defs) + ")"
+
+def message_partitions(cur):
+    """Returns [(name, upper_bound_literal)] for the monthly partitions of `messages`, oldest first."""
+    cur.execute("""
+        SELECT partition_name, partition_description
+        FROM information_schema.partitions
+        WHERE table_schema=DATABASE() AND table_name='messages' AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    """)
+    return [(name, desc) for name, desc in cur.fetchall() if name != "pmax"]
+
+def _partition_bound(desc):
+    # partition_description looks like '2026-11-01'
+    return datetime.strptime(desc.strip("'")[:10], "%Y-%m-%d")
+
+def _partition_existing_messages(cur):
+    """One-off conversion of an unpartitioned `messages` table to monthly partitions."""
+    cur.execute("SELECT MIN(created_at) FROM messages")
+    oldest = cur.fetchone()[0] or datetime.now()
+    cur.execute("ALTER TABLE messages DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)")
+    cur.execute(f"ALTER TABLE messages {_month_partitions_clause(oldest)}")
+
+def ensure_message_partitions(cur):
+    """Splits upcoming months out of `pmax` so new rows never land in it."""
+    parts = message_partitions(cur)
+    last = _partition_bound(parts[-1][1])
+    defs = _partition_defs(last, _add_months(_month_start(datetime.now()), PARTITIONS_AHEAD))
+    if defs:
+        defs.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        cur.execute(f"ALTER TABLE messages REORGANIZE PARTITION pmax INTO ({', '.join(defs)})")
+
+def _migrate_messages_to_owner_copies(cur):
+    """Upgrades a pre-sharding `messages` table to one row per participant."""
+    cur.execute("""ALTER TABLE messages
+                   ADD COLUMN owner_id INT NULL AFTER id,
+                   ADD COLUMN peer_id INT NULL AFTER owner_id""")
+    cur.execute("UPDATE messages SET owner_id=sender_id, peer_id=recipient_id")
+    cur.execute("""
+        INSERT INTO messages (owner_id, peer_id, sender_id, recipient_id, content, created_at)
+        SELECT recipient_id, sender_id, sender_id, recipient_id, content, created_at
+        FROM messages
+        WHERE owner_id=sender_id AND sender_id<>recipient_id
+    """)
+    cur.execute("""ALTER TABLE messages
+                   MODIFY owner_id INT NOT NULL,
+                   MODIFY peer_id INT NOT NULL""")
+    ensure_index(cur, "messages", "idx_messages_conversation", "(owner_id, peer_id, created_at)")
+
+def column_exists(cur, table, column):
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema=DATABASE() AND table_name=%s AND column_name=%s
+        LIMIT 1
+    """, (table, column))
+    return cur.fetchone() is not None
+
+def table_exists(cur, table):
+    cur.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema=DATABASE() AND table_name=%s
+        LIMIT 1
+    """, (table,))
+    return cur.fetchone() is not None
+
+def ensure_index(cur, table, index_name, columns):
+    cur.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema=DATABASE() AND table_name=%s AND index_name=%s
+        LIMIT 1
+    """, (table, index_name))
+    if not cur.fetchone():
+        cur.execute(f"CREATE INDEX {index_name} ON {table} {columns}")
+
 def ensure_admin_exists():
     conn = get_db_connection(MYSQL_DB)
     cur  = conn.cursor()
@@ -209,6 +761,1194 @@ def get_user_by_username(username):
     conn.close()
     return user
 
+SHARDED_TABLES = ["likes", "messages", "messages_archive"]
+
+def _copy_new_rows(src, dst, table, after_id, batch_size, source=None, where="1=1", params=()):
+    """
+    Copies rows with id > after_id in id order; returns the last id copied.
+    `source` (a FROM clause aliasing the table as t) and `where` restrict the
+    rows copied, e.g. to one shard.
+    """
+    scur = src.cursor()
+    dcur = dst.cursor()
+    while True:
+        scur.execute(f"""SELECT t.* FROM {source or table + ' t'}
+                         WHERE t.id > %s AND {where} ORDER BY t.id LIMIT %s""",
+                     (after_id, *params, batch_size))
+        rows = scur.fetchall()
+        src.commit()  # don't pin one snapshot on the live source for the whole copy
+        if not rows:
+            break
+        cols = ",".join(scur.column_names)
+        placeholders = ",".join(["%s"] * len(scur.column_names))
+        dcur.executemany(f"INSERT IGNORE INTO {table} ({cols}) VALUES ({placeholders})", rows)
+        dst.commit()
+        after_id = rows[-1][scur.column_names.index("id")]
+    scur.close()
+    dcur.close()
+    return after_id
+
+def _delete_vanished_rows(src, dst, table, batch_size):
+    """Removes rows from dst that were deleted on src after they were copied (e.g. unlikes)."""
+    scur = src.cursor()
+    dcur = dst.cursor()
+    after_id = 0
+    while True:
+        dcur.execute(f"SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+                     (after_id, batch_size))
+        ids = [r[0] for r in dcur.fetchall()]
+        if not ids:
+            break
+        placeholders = ",".join(["%s"] * len(ids))
+        scur.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", tuple(ids))
+        kept = {r[0] for r in scur.fetchall()}
+        src.commit()
+        gone = [(i,) for i in ids if i not in kept]
+        if gone:
+            dcur.executemany(f"DELETE FROM {table} WHERE id=%s", gone)
+            dst.commit()
+        after_id = ids[-1]
+    scur.close()
+    dcur.close()
+
+def _set_shard_host(shard, host_name, state):
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""
+        INSERT INTO shard_map (shard, host_name, state, updated_at) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE host_name=VALUES(host_name), state=VALUES(state),
+                                updated_at=VALUES(updated_at)
+    """, (shard, host_name, state, datetime.now()))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def move_shard(shard, target_host, batch_size=1000):
+    """
+    Moves one logical shard to `target_host` while the app keeps serving:
+    1. bulk-copy rows while reads and writes continue on the source;
+    2. freeze writes to the shard, wait until every process has seen the freeze,
+       then copy the tail and drop rows deleted meanwhile;
+    3. point the shard at the target. Writers block for at most SHARD_FREEZE_WAIT.
+    The source database is left in place for the operator to drop.
+    """
+    if not SHARD_CONFIG:
+        raise ValueError("sharding is not configured (SHARD_MAP_FILE)")
+    if target_host not in SHARD_CONFIG["hosts"]:
+        raise ValueError(f"unknown host {target_host}")
+    source_host, _ = get_shard_map(refresh=True)[shard]
+    if source_host == target_host:
+        print(f"Shard {shard} already lives on {target_host}")
+        return
+
+    create_shard_database(target_host, shard)
+    src = connect_shard_host(source_host, shard_database(shard))
+    dst = connect_shard_host(target_host, shard_database(shard))
+    try:
+        last_ids = {}
+        for table in SHARDED_TABLES:
+            last_ids[table] = _copy_new_rows(src, dst, table, 0, batch_size)
+            print(f"Shard {shard}: copied {table} up to id {last_ids[table]}")
+
+        _set_shard_host(shard, source_host, "frozen")
+        try:
+            time.sleep(SHARD_MAP_TTL + 1)
+            for table in SHARDED_TABLES:
+                _copy_new_rows(src, dst, table, last_ids[table], batch_size)
+                _delete_vanished_rows(src, dst, table, batch_size)
+        except Exception:
+            _set_shard_host(shard, source_host, "active")
+            raise
+        _set_shard_host(shard, target_host, "active")
+        print(f"Shard {shard} now served by {target_host}; "
+              f"drop {shard_database(shard)} on {source_host} when convenient")
+    finally:
+        src.close()
+        dst.close()
+
+# Where rows left in MYSQL_DB by an unsharded install belong once sharding is
+# enabled: (table, source, shard filter taking (LOGICAL_SHARDS, shard))
+UNSHARDED_MIGRATIONS = [
+    ("likes", "likes t JOIN posts p ON p.id=t.post_id", "MOD(p.user_id, %s)=%s"),
+    ("messages", "messages t", "MOD(t.owner_id, %s)=%s"),
+    ("messages_archive", "messages_archive t", "MOD(t.owner_id, %s)=%s"),
+]
+
+def unsharded_tables_with_rows(cur):
+    """Sharded tables that still have rows in the main database."""
+    leftovers = []
+    for table in SHARDED_TABLES:
+        if table_exists(cur, table):
+            cur.execute(f"SELECT 1 FROM {table} LIMIT 1")
+            if cur.fetchone():
+                leftovers.append(table)
+    return leftovers
+
+def migrate_unsharded_tables(batch_size=1000):
+    """
+    One-time copy of likes/messages rows from MYSQL_DB onto their shards after
+    SHARD_MAP_FILE is enabled on an existing install (likes go to the post
+    author's shard, messages to the owner's). The originals are renamed to
+    <table>_unsharded afterwards, not dropped. Run with the app stopped.
+    """
+    if not SHARD_CONFIG:
+        raise ValueError("sharding is not configured (SHARD_MAP_FILE)")
+    src = get_db_connection(MYSQL_DB)
+    cur = src.cursor()
+    tables = [m for m in UNSHARDED_MIGRATIONS if table_exists(cur, m[0])]
+    try:
+        # a pre-sharding install still has one row per message and no owner_id
+        if any(m[0] == "messages" for m in tables) and not column_exists(cur, "messages", "owner_id"):
+            _migrate_messages_to_owner_copies(cur)
+            src.commit()
+        for shard, (host_name, _) in get_shard_map(refresh=True).items():
+            create_shard_database(host_name, shard)
+            dst = connect_shard_host(host_name, shard_database(shard))
+            try:
+                for table, source, where in tables:
+                    last_id = _copy_new_rows(src, dst, table, 0, batch_size,
+                                             source, where, (LOGICAL_SHARDS, shard))
+                    print(f"Shard {shard}: copied {table} up to id {last_id}")
+            finally:
+                dst.close()
+        if tables:
+            cur.execute("RENAME TABLE " + ", ".join(
+                f"{table} TO {table}_unsharded" for table, _, _ in tables))
+    finally:
+        cur.close()
+        src.close()
+
+@app.cli.command("shard-init")
+@click.option("--batch-size", default=1000, show_default=True)
+def shard_init_command(batch_size):
+    """Copies likes/messages of an unsharded install onto the shards (run once, app stopped)."""
+    migrate_unsharded_tables(batch_size)
+
+@app.cli.command("move-shard")
+@click.argument("shard", type=int)
+@click.argument("target_host")
+@click.option("--batch-size", default=1000, show_default=True)
+def move_shard_command(shard, target_host, batch_size):
+    """Moves logical SHARD to TARGET_HOST (a host name from the shard map) online."""
+    move_shard(shard, target_host, batch_size)
+
+@app.errorhandler(ShardUnavailable)
+def shard_unavailable(e):
+    if request.path.startswith(("/like_api", "/messages_api")):
+        resp = jsonify({"error": "Temporarily unavailable, please retry"})
+    else:
+        resp = Response("Temporarily unavailable, please retry", mimetype="text/plain")
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(SHARD_FREEZE_WAIT)
+    return resp
+
+# ---------------------------------------------------
+# COLD HISTORY ARCHIVE
+# ---------------------------------------------------
+def hot_history_cutoff():
+    """Rows created before this are (or may be) in the *_archive tables."""
+    return _add_months(_month_start(datetime.now()), -HOT_HISTORY_MONTHS)
+
+def _archive_message_partitions(cur, conn, cutoff):
+    for name, upper in message_partitions(cur):
+        if _partition_bound(upper) > cutoff:
+            break
+        cur.execute(f"SELECT MIN(id), MAX(id) FROM messages PARTITION ({name})")
+        lo, hi = cur.fetchone()
+        if lo is not None:
+            # copied server-side in id ranges; INSERT IGNORE makes a rerun after a crash safe
+            for start in range(lo - 1, hi, ARCHIVE_BATCH):
+                cur.execute(f"""
+                    INSERT IGNORE INTO messages_archive
+                        (id, owner_id, peer_id, sender_id, recipient_id, content, created_at)
+                    SELECT id, owner_id, peer_id, sender_id, recipient_id, content, created_at
+                    FROM messages PARTITION ({name})
+                    WHERE id > %s AND id <= %s
+                """, (start, start + ARCHIVE_BATCH))
+                conn.commit()
+        cur.execute(f"ALTER TABLE messages DROP PARTITION {name}")
+        print(f"Archived messages partition {name}")
+
+def _archive_comments(cur, conn, cutoff):
+    while True:
+        cur.execute("SELECT id FROM comments WHERE created_at < %s ORDER BY id LIMIT %s",
+                    (cutoff, ARCHIVE_BATCH))
+        ids = [r[0] for r in cur.fetchall()]
+        if not ids:
+            break
+        placeholders = ",".join(["%s"] * len(ids))
+        cur.execute(f"""
+            INSERT IGNORE INTO comments_archive (id, post_id, user_id, content, created_at)
+            SELECT id, post_id, user_id, content, created_at
+            FROM comments WHERE id IN ({placeholders})
+        """, tuple(ids))
+        cur.execute(f"DELETE FROM comments WHERE id IN ({placeholders})", tuple(ids))
+        conn.commit()
+
+def archive_cold_history():
+    """
+    Keeps HOT_HISTORY_MONTHS of messages/comments in the hot tables: adds upcoming
+    monthly partitions, moves whole old message partitions into messages_archive on
+    every shard, and moves old comments into comments_archive in batches.
+    """
+    cutoff = hot_history_cutoff()
+    for shard in all_shards():
+        conn = get_db_connection(shard=shard, for_write=True)
+        cur  = conn.cursor()
+        ensure_message_partitions(cur)
+        _archive_message_partitions(cur, conn, cutoff)
+        cur.close()
+        conn.close()
+
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    _archive_comments(cur, conn, cutoff)
+    cur.close()
+    conn.close()
+
+@app.cli.command("archive-history")
+def archive_history_command():
+    """Moves messages/comments older than HOT_HISTORY_MONTHS into the archive tables."""
+    archive_cold_history()
+
+# ---------------------------------------------------
+# BACKGROUND JOBS
+# ---------------------------------------------------
+def start_periodic_job(name, interval, fn):
+    """Runs `fn` every `interval` seconds on a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                fn()
+            except Exception as e:
+                print(f"Warning: background job {name} failed: {e}")
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+    return stop
+
+def start_background_jobs():
+    start_periodic_job("explore-rescore", EXPLORE_RESCORE_INTERVAL, rescore_post_scores)
+    start_periodic_job("follow-suggestions", SUGGESTIONS_INTERVAL, compute_follow_suggestions)
+    start_periodic_job("upload-cleanup", UPLOAD_CLEANUP_INTERVAL, cleanup_upload_sessions)
+    start_periodic_job("history-archive", ARCHIVE_INTERVAL, archive_cold_history)
+    start_periodic_job("export-cleanup", UPLOAD_CLEANUP_INTERVAL, cleanup_exports)
+
+# ---------------------------------------------------
+# EXPLORE SCORES
+# ---------------------------------------------------
+def bump_post_score(cur, post_id, weight):
+    """
+    Adds `weight` to a post's engagement score inside the caller's transaction.
+    The stored score is only decayed up to `decayed_at`, so the new weight is scaled
+    up by the same factor; the next rescoring pass then decays both evenly.
+    """
+    cur.execute("""
+        INSERT INTO post_scores (post_id, score, decayed_at)
+        VALUES (%s, GREATEST(%s, 0), NOW())
+        ON DUPLICATE KEY UPDATE score = GREATEST(
+            score + %s * POW(2, TIMESTAMPDIFF(SECOND, decayed_at, NOW()) / %s), 0)
+    """, (post_id, weight, weight, EXPLORE_HALF_LIFE_HOURS * 3600))
+
+def rescore_post_scores(batch_size=EXPLORE_RESCORE_BATCH):
+    """Applies time decay to all scores in post_id batches and prunes dead entries."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(post_id), 0) FROM post_scores")
+    max_id = cur.fetchone()[0]
+    for start in range(0, max_id, batch_size):
+        cur.execute("""
+            UPDATE post_scores
+            SET score = score * POW(0.5, TIMESTAMPDIFF(SECOND, decayed_at, NOW()) / %s),
+                decayed_at = NOW()
+            WHERE post_id > %s AND post_id <= %s
+        """, (EXPLORE_HALF_LIFE_HOURS * 3600, start, start + batch_size))
+        cur.execute("""DELETE FROM post_scores
+                       WHERE post_id > %s AND post_id <= %s AND score < %s""",
+                    (start, start + batch_size, EXPLORE_MIN_SCORE))
+        conn.commit()
+    cur.close()
+    conn.close()
+
+@app.cli.command("rescore-explore")
+def rescore_explore_command():
+    """Applies time decay to Explore scores once (for cron-style scheduling)."""
+    rescore_post_scores()
+
+# ---------------------------------------------------
+# FOLLOW GRAPH
+# ---------------------------------------------------
+def get_follow_counts(cur, user_id):
+    """Returns (follower_count, following_count) from the cached counters."""
+    cur.execute("SELECT follower_count, following_count FROM user_counts WHERE user_id=%s",
+                (user_id,))
+    row = cur.fetchone()
+    if not row:
+        return 0, 0
+    return row["follower_count"], row["following_count"]
+
+def bump_follow_counts(cur, follower_id, followee_id, delta):
+    cur.execute("""
+        INSERT INTO user_counts (user_id, follower_count) VALUES (%s, GREATEST(%s, 0))
+        ON DUPLICATE KEY UPDATE follower_count = GREATEST(follower_count + %s, 0)
+    """, (followee_id, delta, delta))
+    cur.execute("""
+        INSERT INTO user_counts (user_id, following_count) VALUES (%s, GREATEST(%s, 0))
+        ON DUPLICATE KEY UPDATE following_count = GREATEST(following_count + %s, 0)
+    """, (follower_id, delta, delta))
+
+def recount_follow_counts(cur):
+    """Rebuilds the cached counters from the `follows` table."""
+    cur.execute("UPDATE user_counts SET follower_count=0, following_count=0")
+    cur.execute("""
+        INSERT INTO user_counts (user_id, follower_count)
+        SELECT followee_id, COUNT(*) FROM follows GROUP BY followee_id
+        ON DUPLICATE KEY UPDATE follower_count=VALUES(follower_count)
+    """)
+    cur.execute("""
+        INSERT INTO user_counts (user_id, following_count)
+        SELECT follower_id, COUNT(*) FROM follows GROUP BY follower_id
+        ON DUPLICATE KEY UPDATE following_count=VALUES(following_count)
+    """)
+
+def compute_follow_suggestions(batch_size=SUGGESTIONS_BATCH, per_user=SUGGESTIONS_PER_USER):
+    """
+    Recomputes friends-of-friends suggestions for every user. Users are walked in id
+    order one batch at a time and each user keeps only its top `per_user` candidates,
+    so memory stays bounded regardless of graph size.
+    """
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    last_id = 0
+    while True:
+        cur.execute("SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                    (last_id, batch_size))
+        user_ids = [r[0] for r in cur.fetchall()]
+        if not user_ids:
+            break
+        for uid in user_ids:
+            cur.execute("""
+                SELECT f2.followee_id, COUNT(*) AS mutuals
+                FROM follows f1
+                JOIN follows f2 ON f2.follower_id = f1.followee_id
+                WHERE f1.follower_id = %s
+                  AND f2.followee_id <> %s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM follows f3
+                      WHERE f3.follower_id = %s AND f3.followee_id = f2.followee_id
+                  )
+                GROUP BY f2.followee_id
+                ORDER BY mutuals DESC
+                LIMIT %s
+            """, (uid, uid, uid, per_user))
+            candidates = cur.fetchall()
+            cur.execute("DELETE FROM follow_suggestions WHERE user_id=%s", (uid,))
+            if candidates:
+                cur.executemany("""INSERT INTO follow_suggestions (user_id, suggested_id, mutuals)
+                                   VALUES (%s, %s, %s)""",
+                                [(uid, cid, m) for cid, m in candidates])
+        conn.commit()
+        last_id = user_ids[-1]
+    cur.close()
+    conn.close()
+
+@app.cli.command("recount-follows")
+def recount_follows_command():
+    """Recomputes every user's follower/following counters from `follows`."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    recount_follow_counts(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+@app.cli.command("suggest-follows")
+def suggest_follows_command():
+    """Recomputes friends-of-friends follow suggestions once."""
+    compute_follow_suggestions()
+
+# ---------------------------------------------------
+# VIDEO TRANSCODING (HLS)
+# ---------------------------------------------------
+_transcode_pool = None
+_transcoding    = {}   # filename -> a newer upload is waiting for the running job
+_transcode_lock = threading.Lock()
+# spawn, not fork: forking a process that already runs threads (shard
+# fan-out, profiler, jobs) can deadlock children on inherited locks
+_transcode_mp_context = multiprocessing.get_context("spawn")
+
+def _bitrate_bps(rate):
+    return int(rate.rstrip("k")) * 1000
+
+def _probe_height(src_path):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=height", "-of", "csv=p=0", src_path],
+        check=True, capture_output=True, text=True, timeout=60
+    ).stdout.strip()
+    return int(out.splitlines()[0]) if out else 0
+
+def transcode_video(src_path, out_dir):
+    """
+    Runs in the transcode process pool. Writes one HLS rendition per configured
+    height (never upscaling), a poster frame and a master playlist. Output is built
+    in a temp dir and renamed into place, so a visible master.m3u8 means ready.
+    """
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    height = _probe_height(src_path)
+    renditions = [r for r in TRANSCODE_RENDITIONS if r[0] <= height] or TRANSCODE_RENDITIONS[:1]
+    for h, vbr, abr in renditions:
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error", "-i", src_path,
+            "-vf", f"scale=-2:{h}",
+            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main",
+            "-b:v", vbr, "-maxrate", vbr, "-bufsize", f"{2 * _bitrate_bps(vbr)}",
+            "-c:a", "aac", "-b:a", abr, "-ac", "2",
+            "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+            "-hls_segment_filename", os.path.join(tmp_dir, f"{h}p_%04d.ts"),
+            os.path.join(tmp_dir, f"{h}p.m3u8")
+        ], check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-i", src_path,
+        "-vf", f"thumbnail,scale=-2:{renditions[-1][0]}", "-frames:v", "1",
+        os.path.join(tmp_dir, "poster.jpg")
+    ], check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+
+    with open(os.path.join(tmp_dir, "master.m3u8"), "w") as f:
+        f.write("#EXTM3U\n")
+        for h, vbr, abr in renditions:
+            f.write(f"#EXT-X-STREAM-INF:BANDWIDTH={_bitrate_bps(vbr) + _bitrate_bps(abr)}\n")
+            f.write(f"{h}p.m3u8\n")
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+def _hls_dir(filename):
+    return os.path.join(HLS_FOLDER, filename)
+
+def enqueue_transcode(filename):
+    """
+    Queues a freshly saved video for HLS transcoding in the bounded process pool.
+    Uploads can reuse a filename, so renditions of the previous file are removed
+    right away, and a job already running on the old file is followed by a new one.
+    """
+    if not filename or os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
+        return
+    shutil.rmtree(_hls_dir(filename), ignore_errors=True)
+    if not shutil.which("ffmpeg"):
+        print("Warning: ffmpeg not found, videos will be served as uploaded")
+        return
+
+    with _transcode_lock:
+        if filename in _transcoding:
+            _transcoding[filename] = True
+            return
+        _transcoding[filename] = False
+    _submit_transcode(filename)
+
+def _submit_transcode(filename):
+    global _transcode_pool
+    with _transcode_lock:
+        if _transcode_pool is None:
+            _transcode_pool = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS,
+                                                  mp_context=_transcode_mp_context)
+        os.makedirs(HLS_FOLDER, exist_ok=True)
+        future = _transcode_pool.submit(
+            transcode_video,
+            os.path.join(app.config["UPLOAD_FOLDER"], filename),
+            _hls_dir(filename)
+        )
+
+    def done(fut):
+        if fut.exception():
+            print(f"Warning: transcoding {filename} failed: {fut.exception()}")
+        with _transcode_lock:
+            rerun = _transcoding.pop(filename, False)
+            if rerun:
+                _transcoding[filename] = False
+        if rerun:
+            # this job read the replaced file; drop its output and start over
+            shutil.rmtree(_hls_dir(filename), ignore_errors=True)
+            _submit_transcode(filename)
+    future.add_done_callback(done)
+
+app.jinja_env.globals.update(HLS_JS_URL=HLS_JS_URL, HLS_JS_INTEGRITY=HLS_JS_INTEGRITY)
+
+@app.template_global()
+def hls_url(filename):
+    """URL of the adaptive stream for an uploaded video, or None until it is ready."""
+    if filename and os.path.exists(os.path.join(_hls_dir(filename), "master.m3u8")):
+        return url_for("static", filename=f"uploads/hls/{filename}/master.m3u8")
+    return None
+
+@app.template_global()
+def poster_url(filename):
+    if filename and os.path.exists(os.path.join(_hls_dir(filename), "poster.jpg")):
+        return url_for("static", filename=f"uploads/hls/{filename}/poster.jpg")
+    return None
+
+@app.cli.command("transcode-missing")
+def transcode_missing_command():
+    """Transcodes every uploaded video that has no HLS renditions yet (runs in the foreground)."""
+    os.makedirs(HLS_FOLDER, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS,
+                             mp_context=_transcode_mp_context) as pool:
+        futures = {}
+        for fn in os.listdir(app.config["UPLOAD_FOLDER"]):
+            if (os.path.splitext(fn)[1].lower() in VIDEO_EXTENSIONS
+                    and not os.path.exists(os.path.join(_hls_dir(fn), "master.m3u8"))):
+                futures[fn] = pool.submit(transcode_video,
+                                          os.path.join(app.config["UPLOAD_FOLDER"], fn),
+                                          _hls_dir(fn))
+        for fn, fut in futures.items():
+            try:
+                fut.result()
+                print(f"Transcoded {fn}")
+            except Exception as e:
+                print(f"Warning: transcoding {fn} failed: {e}")
+
+# ---------------------------------------------------
+# DATA EXPORT
+# ---------------------------------------------------
+_export_pool = None
+_export_lock = threading.Lock()
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable sink zipfile writes into; the export generator drains it chunk by chunk."""
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def export_sources(user_id):
+    """Files of a user's export: (name, [(query, params, shard), ...])."""
+    uid = (user_id,)
+    return [
+        ("profile.ndjson", [("SELECT id, username, profile_picture, bio FROM users WHERE id=%s",
+                             uid, None)]),
+        ("posts.ndjson", [("""SELECT id, content, media_filename, created_at
+                              FROM posts WHERE user_id=%s ORDER BY id""", uid, None)]),
+        ("stories.ndjson", [("""SELECT id, media_filename, created_at
+                                FROM stories WHERE user_id=%s ORDER BY id""", uid, None)]),
+        ("comments.ndjson", [
+            ("SELECT id, post_id, content, created_at FROM comments WHERE user_id=%s", uid, None),
+            ("SELECT id, post_id, content, created_at FROM comments_archive WHERE user_id=%s", uid, None),
+        ]),
+        ("saved_posts.ndjson", [("SELECT post_id FROM saved_posts WHERE user_id=%s", uid, None)]),
+        ("following.ndjson", [("""SELECT u.username, f.created_at FROM follows f
+                                  JOIN users u ON u.id=f.followee_id
+                                  WHERE f.follower_id=%s""", uid, None)]),
+        ("followers.ndjson", [("""SELECT u.username, f.created_at FROM follows f
+                                  JOIN users u ON u.id=f.follower_id
+                                  WHERE f.followee_id=%s""", uid, None)]),
+        # likes live on the shard of each post's author
+        ("likes.ndjson", [("SELECT post_id FROM likes WHERE user_id=%s", uid, shard)
+                          for shard in all_shards()]),
+        # the user's own copy of every conversation lives on their shard
+        ("messages.ndjson", [
+            ("""SELECT id, peer_id, sender_id, recipient_id, content, created_at
+                FROM messages WHERE owner_id=%s""", uid, shard_for_user(user_id)),
+            ("""SELECT id, peer_id, sender_id, recipient_id, content, created_at
+                FROM messages_archive WHERE owner_id=%s""", uid, shard_for_user(user_id)),
+        ]),
+    ]
+
+def iter_user_export(user_id):
+    """
+    Yields a ZIP archive of the user's rows (one NDJSON file per table) followed
+    by their uploaded media, without holding more than ~EXPORT_CHUNK_SIZE in memory.
+    """
+    sink  = _ZipSink()
+    media = set()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, sources in export_sources(user_id):
+            with zf.open(name, "w", force_zip64=True) as out:
+                for query, params, shard in sources:
+                    rows = stream_rows(query, params, shard=shard, fetch_size=EXPORT_FETCH_SIZE)
+                    try:
+                        for row in rows:
+                            for key in ("media_filename", "profile_picture"):
+                                if row.get(key):
+                                    media.add(os.path.basename(row[key]))
+                            out.write((json.dumps(row, default=str) + "\n").encode("utf-8"))
+                            if sink.size >= EXPORT_CHUNK_SIZE:
+                                yield sink.drain()
+                    finally:
+                        rows.close()
+
+        for fn in sorted(media):
+            path = os.path.join(app.config["UPLOAD_FOLDER"], fn)
+            if not os.path.isfile(path):
+                continue
+            info = zipfile.ZipInfo.from_file(path, f"media/{fn}")
+            info.compress_type = zipfile.ZIP_STORED  # images/video are already compressed
+            with open(path, "rb") as src, zf.open(info, "w", force_zip64=True) as out:
+                while True:
+                    block = src.read(EXPORT_CHUNK_SIZE)
+                    if not block:
+                        break
+                    out.write(block)
+                    if sink.size >= EXPORT_CHUNK_SIZE:
+                        yield sink.drain()
+    yield sink.drain()
+
+def estimate_export_rows(user_id):
+    """Index-only row count deciding whether an export streams inline or runs as a job."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""SELECT (SELECT COUNT(*) FROM posts WHERE user_id=%s)
+                        + (SELECT COUNT(*) FROM comments WHERE user_id=%s)
+                        + (SELECT COUNT(*) FROM comments_archive WHERE user_id=%s)""",
+                (user_id, user_id, user_id))
+    total = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    for row in shard_query(shard_for_user(user_id),
+                           """SELECT (SELECT COUNT(*) FROM messages WHERE owner_id=%s)
+                                   + (SELECT COUNT(*) FROM messages_archive WHERE owner_id=%s) AS c""",
+                           (user_id, user_id)):
+        total += row["c"]
+    return int(total)
+
+def export_path(job_id):
+    return os.path.join(EXPORT_FOLDER, f"{job_id}.zip")
+
+def write_user_export(user_id, path):
+    """Writes the export archive to `path`, renaming into place once complete."""
+    tmp = path + ".part"
+    with open(tmp, "wb") as f:
+        for chunk in iter_user_export(user_id):
+            f.write(chunk)
+    os.replace(tmp, path)
+
+def _set_export_status(job_id, status):
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    finished = datetime.now() if status in ("ready", "failed") else None
+    cur.execute("UPDATE export_jobs SET status=%s, finished_at=%s WHERE id=%s",
+                (status, finished, job_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def _run_export_job(job_id, user_id):
+    _set_export_status(job_id, "running")
+    try:
+        write_user_export(user_id, export_path(job_id))
+    except Exception as e:
+        print(f"Warning: export {job_id} failed: {e}")
+        _set_export_status(job_id, "failed")
+        return
+    _set_export_status(job_id, "ready")
+
+def enqueue_export(user_id, requested_by):
+    """
+    Records a background export of `user_id` and hands it to the bounded export
+    pool. An export already in flight for the same user is reused.
+    """
+    global _export_pool
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""SELECT id FROM export_jobs
+                   WHERE user_id=%s AND status IN ('pending','running') AND created_at >= %s
+                   ORDER BY created_at DESC LIMIT 1""", (user_id, export_stale_cutoff()))
+    row = cur.fetchone()
+    if row:
+        cur.close()
+        conn.close()
+        return row[0]
+
+    job_id = uuid.uuid4().hex
+    cur.execute("""INSERT INTO export_jobs (id,user_id,requested_by,status,created_at)
+                   VALUES (%s,%s,%s,'pending',%s)""",
+                (job_id, user_id, requested_by, datetime.now()))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+    with _export_lock:
+        if _export_pool is None:
+            _export_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS,
+                                              thread_name_prefix="export")
+        _export_pool.submit(_run_export_job, job_id, user_id)
+    return job_id
+
+def export_stale_cutoff():
+    return datetime.now() - timedelta(seconds=EXPORT_STALE_AFTER)
+
+def cleanup_exports():
+    """
+    Fails jobs orphaned by a restart (in flight past EXPORT_STALE_AFTER) and
+    drops jobs older than EXPORT_TTL along with their archives.
+    """
+    cutoff = datetime.now() - timedelta(seconds=EXPORT_TTL)
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""UPDATE export_jobs SET status='failed', finished_at=%s
+                   WHERE status IN ('pending','running') AND created_at < %s""",
+                (datetime.now(), export_stale_cutoff()))
+    conn.commit()
+    while True:
+        cur.execute("SELECT id FROM export_jobs WHERE created_at < %s LIMIT 500", (cutoff,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        for (job_id,) in rows:
+            for path in (export_path(job_id), export_path(job_id) + ".part"):
+                if os.path.exists(path):
+                    os.remove(path)
+        cur.executemany("DELETE FROM export_jobs WHERE id=%s", rows)
+        conn.commit()
+    cur.close()
+    conn.close()
+
+@app.cli.command("export-user")
+@click.argument("username")
+@click.argument("output", type=click.Path(dir_okay=False))
+def export_user_command(username, output):
+    """Writes USERNAME's data export (ZIP of NDJSON + media) to OUTPUT."""
+    user = get_user_by_username(username)
+    if not user:
+        raise click.ClickException(f"No such user: {username}")
+    write_user_export(user["id"], output)
+    print(f"Exported {username} to {output}")
+
+# ---------------------------------------------------
+# STREAMED RENDERING + COMPRESSION
+# ---------------------------------------------------
+def _buffer_chunks(pieces, size=STREAM_CHUNK_SIZE):
+    """Joins Jinja's tiny output pieces into chunks of roughly `size` characters."""
+    buf, buf_len = [], 0
+    try:
+        for piece in pieces:
+            buf.append(piece)
+            buf_len += len(piece)
+            if buf_len >= size:
+                yield "".join(buf)
+                buf, buf_len = [], 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        if hasattr(pieces, "close"):
+            pieces.close()
+
+def render_page(template_name, **context):
+    """
+    Renders an HTML page. With STREAM_TEMPLATES on, the template is streamed so the
+    first bytes go out while generator-backed context values are still being fetched.
+    """
+    if not STREAM_TEMPLATES:
+        return Response(render_template(template_name, **context), mimetype="text/html")
+    # Pop flashed messages now: the session cookie is written before the body streams
+    get_flashed_messages(with_categories=True)
+    return Response(_buffer_chunks(stream_template(template_name, **context)),
+                    mimetype="text/html")
+
+def _negotiate_encoding():
+    available = ["br", "gzip"] if brotli else ["gzip"]
+    return request.accept_encodings.best_match(available)
+
+def _make_compressor(encoding):
+    """Returns (compress, flush, finish) callables for the chosen encoding."""
+    if encoding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.flush, c.finish
+    # wbits=31 -> gzip container
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+def _compress_stream(chunks, encoding):
+    compress, flush, finish = _make_compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            # flush per chunk so the browser can start parsing early
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+@app.after_request
+def compress_response(response):
+    if (response.mimetype not in COMPRESS_MIMETYPES
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = _negotiate_encoding()
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compress, _, finish = _make_compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+# ---------------------------------------------------
+# REQUEST PROFILER
+# ---------------------------------------------------
+# Sampled requests register their thread here; one sampler thread reads their
+# stacks via sys._current_frames() and their DB connections time every
+# statement. Unsampled requests pay one dict lookup per connection.
+_profile_settings = {"rate": PROFILE_SAMPLE_RATE, "endpoint": None, "until": 0.0,
+                     "slow_ms": PROFILE_SLOW_MS}
+_active_profiles  = {}   # thread id -> capture in progress
+_profile_captures = deque(maxlen=PROFILE_MAX_CAPTURES)
+_profile_lock     = threading.Lock()
+_profile_wakeup   = threading.Event()
+_sampler_thread   = None
+PROFILER_ENDPOINTS = {"profiler_status", "profiler_capture", "profiler_folded", "static"}
+
+class _ProfiledCursor:
+    """Cursor proxy recording each statement and its execution time."""
+    def __init__(self, cur, prof):
+        self._cur  = cur
+        self._prof = prof
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def execute(self, query, params=None, *args, **kwargs):
+        return self._timed(self._cur.execute, query, params, *args, **kwargs)
+
+    def executemany(self, query, seq_params, *args, **kwargs):
+        return self._timed(self._cur.executemany, query, seq_params, *args, **kwargs)
+
+    def _timed(self, method, query, params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(query, params, *args, **kwargs)
+        finally:
+            _record_sql(self._prof, query, (time.perf_counter() - start) * 1000)
+
+class _ProfiledConnection:
+    """Connection proxy handing out _ProfiledCursor for a sampled request."""
+    def __init__(self, conn, prof):
+        self._conn = conn
+        self._prof = prof
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return _ProfiledCursor(self._conn.cursor(*args, **kwargs), self._prof)
+
+def _record_sql(prof, query, ms):
+    if len(prof["sql"]) >= PROFILE_MAX_SQL:
+        prof["sql_dropped"] += 1
+        return
+    prof["sql"].append({"sql": " ".join(str(query).split())[:PROFILE_SQL_MAX_LEN],
+                        "ms": round(ms, 3)})
+
+def _profiled_call(prof, fn, *args):
+    """Runs fn on a helper thread, attributing its samples and SQL to `prof`."""
+    if prof is None:
+        return fn(*args)
+    tid = threading.get_ident()
+    with _profile_lock:
+        _active_profiles[tid] = prof
+    try:
+        return fn(*args)
+    finally:
+        with _profile_lock:
+            _active_profiles.pop(tid, None)
+
+def _collapse_stack(frame):
+    """Formats a stack as 'file:func;file:func' (root first), the folded-stack format."""
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _sampler_loop():
+    while True:
+        _profile_wakeup.wait()
+        frames = sys._current_frames()
+        with _profile_lock:
+            for tid, prof in _active_profiles.items():
+                frame = frames.get(tid)
+                if frame is not None and not prof["done"]:
+                    prof["stacks"][_collapse_stack(frame)] += 1
+            if not _active_profiles:
+                _profile_wakeup.clear()
+        del frames
+        time.sleep(PROFILE_INTERVAL)
+
+def _ensure_sampler():
+    global _sampler_thread
+    with _profile_lock:
+        if _sampler_thread is None:
+            _sampler_thread = threading.Thread(target=_sampler_loop, name="profiler", daemon=True)
+            _sampler_thread.start()
+
+def _should_profile():
+    if request.endpoint in PROFILER_ENDPOINTS:
+        return False
+    if _profile_settings["endpoint"] and time.time() < _profile_settings["until"]:
+        return request.endpoint == _profile_settings["endpoint"]
+    rate = _profile_settings["rate"]
+    return rate > 0 and random.random() < rate
+
+@app.before_request
+def start_request_profile():
+    if not _should_profile():
+        return
+    prof = {
+        "id": uuid.uuid4().hex[:12],
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "path": request.path,
+        "started_at": datetime.now(),
+        "start": time.perf_counter(),
+        "stacks": Counter(),
+        "sql": [],
+        "sql_dropped": 0,
+        "done": False,
+    }
+    tid = threading.get_ident()
+    with _profile_lock:
+        # bounded so that sampling never scales with load
+        if len({id(p) for p in _active_profiles.values()}) >= PROFILE_MAX_ACTIVE:
+            return
+        _active_profiles[tid] = prof
+        _profile_wakeup.set()
+    _ensure_sampler()
+    g.profile = (tid, prof)
+
+def _finish_profile(tid, prof, status):
+    with _profile_lock:
+        if _active_profiles.get(tid) is prof:
+            del _active_profiles[tid]
+        prof["done"] = True
+    prof["duration_ms"] = round((time.perf_counter() - prof.pop("start")) * 1000, 3)
+    prof["status"] = status
+    if prof["duration_ms"] >= _profile_settings["slow_ms"]:
+        _profile_captures.append(prof)
+
+@app.after_request
+def finish_request_profile(response):
+    if "profile" in g:
+        tid, prof = g.pop("profile")
+        # streamed bodies are still running here; stop once fully sent
+        response.call_on_close(lambda: _finish_profile(tid, prof, response.status_code))
+    return response
+
+@app.teardown_request
+def abort_request_profile(exc):
+    if "profile" in g:
+        tid, prof = g.pop("profile")
+        _finish_profile(tid, prof, 500)
+
+def _capture_summary(prof):
+    return {
+        "id": prof["id"],
+        "endpoint": prof["endpoint"],
+        "method": prof["method"],
+        "path": prof["path"],
+        "status": prof["status"],
+        "started_at": prof["started_at"].isoformat(),
+        "duration_ms": prof["duration_ms"],
+        "samples": sum(prof["stacks"].values()),
+        "sql_count": len(prof["sql"]) + prof["sql_dropped"],
+        "sql_ms": round(sum(q["ms"] for q in prof["sql"]), 3),
+    }
+
+def folded_stacks(captures):
+    """Aggregates captures into flamegraph.pl / speedscope 'stack count' lines."""
+    totals = Counter()
+    for prof in captures:
+        for stack, n in prof["stacks"].items():
+            totals[f"{prof['endpoint']};{stack}"] += n
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(totals.items()))
+
+# ---------------------------------------------------
+# RATE LIMITING
+# ---------------------------------------------------
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+def parse_rate(spec):
+    """'30/60' -> (burst 30, refill 0.5 tokens/s); 'off' -> None."""
+    if spec == "off":
+        return None
+    count, seconds = spec.split("/")
+    return int(count), int(count) / float(seconds)
+
+RATE_LIMITS = {
+    endpoint: parse_rate(os.environ.get(f"RATE_LIMIT_{endpoint.upper()}", spec))
+    for endpoint, spec in RATE_LIMIT_DEFAULTS.items()
+}
+
+class MemoryBuckets:
+    """Token buckets held in this process."""
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self._buckets  = {}   # key -> (tokens, updated, full_at)
+        self._lock     = threading.Lock()
+        self._max_keys = max_keys
+
+    def take(self, key, capacity, rate, cost=1, now=None):
+        """
+        Takes `cost` tokens (0 only checks); returns 0 if allowed, else seconds
+        until a token is available.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= cost
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self._max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # a bucket that has refilled completely is the same as no bucket
+        for key in [k for k, b in self._buckets.items() if b[2] <= now]:
+            del self._buckets[key]
+
+# Refill and take atomically on the redis server, using its clock so that
+# every app process agrees on the time
+REDIS_TAKE_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or capacity
+local ts = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    """
+    Token buckets shared through a redis-compatible server. While the server
+    is unreachable, limits fall back to this process's buckets.
+    """
+    def __init__(self, url):
+        self._client   = redis.Redis.from_url(url)
+        self._take     = self._client.register_script(REDIS_TAKE_SCRIPT)
+        self._fallback = MemoryBuckets()
+        self._warned_at = 0.0
+
+    def take(self, key, capacity, rate, cost=1):
+        try:
+            return float(self._take(keys=[f"ratelimit:{key}"], args=[capacity, rate, cost]))
+        except redis.RedisError as e:
+            if time.monotonic() - self._warned_at > 60:
+                self._warned_at = time.monotonic()
+                print(f"Warning: rate limit store unavailable, using local buckets: {e}")
+            return self._fallback.take(key, capacity, rate, cost)
+
+def make_rate_limiter():
+    if RATE_LIMIT_REDIS_URL:
+        if redis is not None:
+            return RedisBuckets(RATE_LIMIT_REDIS_URL)
+        print("Warning: RATE_LIMIT_REDIS_URL is set but redis is not installed, "
+              "using per-process rate limits")
+    return MemoryBuckets()
+
+RATE_LIMITER = make_rate_limiter()
+
+def _rate_limit_keys(endpoint):
+    """(bucket key, tokens to take, RATE_LIMITS entry) for this request."""
+    if endpoint == "login":
+        # each client pays per attempt; the account's bucket has its own,
+        # looser limit, is only checked here and is charged on failure
+        # (charge_failed_login), so successful logins never drain it
+        return [(f"login:ip:{request.remote_addr}", 1, "login"),
+                (_login_name_key(request.form.get("username", "")), 0, "login_name")]
+    user_id = get_current_user_id()
+    if user_id:
+        return [(f"{endpoint}:user:{user_id}", 1, endpoint)]
+    return [(f"{endpoint}:ip:{request.remote_addr}", 1, endpoint)]
+
+def _login_name_key(username):
+    return f"login:name:{username.lower()}"
+
+def charge_failed_login(username):
+    limit = RATE_LIMITS.get("login_name")
+    if RATE_LIMIT_ENABLED and limit:
+        RATE_LIMITER.take(_login_name_key(username), *limit)
+
+@app.before_request
+def enforce_rate_limit():
+    """Throttles writes (POST) to the endpoints in RATE_LIMITS before any DB work."""
+    limit = RATE_LIMITS.get(request.endpoint)
+    if not RATE_LIMIT_ENABLED or not limit or request.method != "POST":
+        return
+    wait = 0.0
+    for key, cost, kind in _rate_limit_keys(request.endpoint):
+        if RATE_LIMITS.get(kind):
+            wait = max(wait, RATE_LIMITER.take(key, *RATE_LIMITS[kind], cost))
+    if wait > 0:
+        raise RateLimited(wait)
+
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    if request.endpoint and request.endpoint.endswith("_api"):
+        resp = jsonify({"error": "Too many requests, please slow down"})
+    else:
+        resp = Response("Too many requests, please slow down", mimetype="text/plain")
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return resp
+
 # ---------------------------------------------------
 # FLASK APP ROUTES
 # ---------------------------------------------------
@@ -266,6 +2006,7 @@ def login():
             flash("Welcome back!", "success")
             return redirect(url_for("feed"))
         else:
+            charge_failed_login(username)
             flash("Invalid username or password!", "error")
     return render_template("login.html")
 
@@ -302,12 +2043,21 @@ def feed():
                 fn = secure_filename(media_file.filename)
                 media_file.save(os.path.join(app.config["UPLOAD_FOLDER"], fn))
                 media_filename = fn
+        elif request.form.get("upload_id"):
+            media_filename = claim_upload(request.form["upload_id"], user_id)
+            if not media_filename:
+                cur.close()
+                conn.close()
+                flash("Upload not found or not finished","error")
+                return redirect(url_for("feed"))
 
         if content or media_filename:
             now = datetime.now()
             cur.execute("""INSERT INTO posts (user_id,content,media_filename,created_at)
                            VALUES (%s,%s,%s,%s)""",(user_id, content, media_filename, now))
+            bump_post_score(cur, cur.lastrowid, POST_BASE_SCORE)
             conn.commit()
+            enqueue_transcode(media_filename)
 
     # stories
     cutoff = datetime.now() - timedelta(hours=24)
@@ -319,61 +2069,109 @@ def feed():
         WHERE s.created_at >= %s
         ORDER BY s.created_at DESC
     """, (cutoff,))
-    stories = cur.fetchall()
-
-    # posts
-    cur.execute("""
-        SELECT p.id, p.user_id, p.content, p.media_filename, p.created_at,
-               u.username, u.profile_picture
-        FROM posts p
-        JOIN users u ON p.user_id=u.id
-        ORDER BY p.created_at DESC
-    """)
-    raw_posts = cur.fetchall()
-
-    # load each post's like/save data + comments
-    posts = []
-    for p in raw_posts:
-        post_id = p["id"]
-        cur.execute("SELECT COUNT(*) as c FROM likes WHERE post_id=%s",(post_id,))
-        lr = cur.fetchone()
-        like_count = lr["c"] if lr else 0
-
-        cur.execute("SELECT id FROM likes WHERE post_id=%s AND user_id=%s",(post_id, user_id))
-        rlike = cur.fetchone()
-        user_has_liked = True if rlike else False
-
-        cur.execute("SELECT id FROM saved_posts WHERE post_id=%s AND user_id=%s",(post_id, user_id))
-        rsave = cur.fetchone()
-        user_has_saved = True if rsave else False
-
-        # get comments
-        cur.execute("""
-            SELECT c.*, u.username, u.profile_picture
-            FROM comments c
-            JOIN users u ON c.user_id=u.id
-            WHERE c.post_id=%s
-            ORDER BY c.created_at ASC
-        """,(post_id,))
-        comment_rows = cur.fetchall()
-
-        posts.append({
-            "id": p["id"],
-            "user_id": p["user_id"],
-            "content": p["content"],
-            "media_filename": p["media_filename"],
-            "created_at": p["created_at"],
-            "username": p["username"],
-            "profile_picture": p["profile_picture"],
-            "like_count": like_count,
-            "user_has_liked": user_has_liked,
-            "user_has_saved": user_has_saved,
-            "comments": comment_rows
-        })
+    stories = cur.fetchall()
+
+    cur.close()
+    conn.close()
+
+    # posts are streamed into the template as they are fetched
+    posts = iter_feed_posts(user_id)
+    resp = render_page("feed.html", stories=stories, posts=posts, current_user_id=user_id)
+    resp.call_on_close(posts.close)
+    return resp
+
+@app.route("/explore")
+def explore():
+    """Posts ranked by time-decayed engagement, read as a range of the post_scores index."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return redirect(url_for("login"))
 
+    page = max(request.args.get("page", 1, type=int), 1)
+    # posts are streamed, so look one past this page up front for the pager
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("SELECT 1 FROM post_scores ORDER BY score DESC LIMIT 1 OFFSET %s",
+                (page * EXPLORE_PAGE_SIZE,))
+    has_next = cur.fetchone() is not None
     cur.close()
     conn.close()
-    return render_template("feed.html", stories=stories, posts=posts, current_user_id=user_id)
+
+    posts = iter_feed_posts(user_id, """
+        SELECT p.id, p.user_id, p.content, p.media_filename, p.created_at,
+               u.username, u.profile_picture
+        FROM post_scores ps
+        JOIN posts p ON p.id=ps.post_id
+        JOIN users u ON p.user_id=u.id
+        ORDER BY ps.score DESC
+        LIMIT %s OFFSET %s
+    """, (EXPLORE_PAGE_SIZE, (page - 1) * EXPLORE_PAGE_SIZE))
+    resp = render_page("feed.html", stories=[], posts=posts, current_user_id=user_id,
+                       explore=True, page=page, has_next=has_next)
+    resp.call_on_close(posts.close)
+    return resp
+
+FEED_POSTS_QUERY = """
+    SELECT p.id, p.user_id, p.content, p.media_filename, p.created_at,
+           u.username, u.profile_picture
+    FROM posts p
+    JOIN users u ON p.user_id=u.id
+    ORDER BY p.created_at DESC
+"""
+
+def iter_feed_posts(user_id, query=FEED_POSTS_QUERY, params=()):
+    """Yields feed posts with their like/save state and comments, one post at a time."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    archive_cutoff = hot_history_cutoff()
+    try:
+        for batch in iter_batches(stream_rows(query, params), STREAM_BATCH_SIZE):
+            # likes are sharded by post author: one grouped lookup per batch
+            likes = like_stats(batch, user_id)
+            for p in batch:
+                post_id = p["id"]
+                like_count, user_has_liked = likes.get(post_id, (0, False))
+
+                cur.execute("SELECT id FROM saved_posts WHERE post_id=%s AND user_id=%s",(post_id, user_id))
+                rsave = cur.fetchone()
+                user_has_saved = True if rsave else False
+
+                # get comments; only posts older than the hot window can have archived ones
+                comment_rows = []
+                if p["created_at"] < archive_cutoff:
+                    cur.execute("""
+                        SELECT c.*, u.username, u.profile_picture
+                        FROM comments_archive c
+                        JOIN users u ON c.user_id=u.id
+                        WHERE c.post_id=%s
+                        ORDER BY c.created_at ASC
+                    """,(post_id,))
+                    comment_rows = cur.fetchall()
+                cur.execute("""
+                    SELECT c.*, u.username, u.profile_picture
+                    FROM comments c
+                    JOIN users u ON c.user_id=u.id
+                    WHERE c.post_id=%s
+                    ORDER BY c.created_at ASC
+                """,(post_id,))
+                comment_rows += cur.fetchall()
+
+                yield {
+                    "id": p["id"],
+                    "user_id": p["user_id"],
+                    "content": p["content"],
+                    "media_filename": p["media_filename"],
+                    "created_at": p["created_at"],
+                    "username": p["username"],
+                    "profile_picture": p["profile_picture"],
+                    "like_count": like_count,
+                    "user_has_liked": user_has_liked,
+                    "user_has_saved": user_has_saved,
+                    "comments": comment_rows
+                }
+    finally:
+        cur.close()
+        conn.close()
 
 @app.route("/like_api/<int:post_id>", methods=["POST"])
 def like_api(post_id):
@@ -383,20 +2181,34 @@ def like_api(post_id):
 
     conn = get_db_connection(MYSQL_DB)
     cur  = conn.cursor(dictionary=True)
-    cur.execute("SELECT id FROM likes WHERE post_id=%s AND user_id=%s",(post_id, user_id))
-    row = cur.fetchone()
+    cur.execute("SELECT user_id FROM posts WHERE id=%s",(post_id,))
+    post = cur.fetchone()
+    if not post:
+        cur.close()
+        conn.close()
+        return jsonify({"error":"Post not found"}), 404
+
+    # likes live on the post author's shard
+    sconn = get_db_connection(shard=shard_for_user(post["user_id"]), for_write=True)
+    scur  = sconn.cursor(dictionary=True)
+    scur.execute("SELECT id FROM likes WHERE post_id=%s AND user_id=%s",(post_id, user_id))
+    row = scur.fetchone()
     if row:
-        cur.execute("DELETE FROM likes WHERE id=%s",(row["id"],))
+        scur.execute("DELETE FROM likes WHERE id=%s",(row["id"],))
         action = "unliked"
     else:
-        cur.execute("INSERT INTO likes (post_id,user_id) VALUES(%s,%s)",(post_id, user_id))
+        scur.execute("INSERT INTO likes (post_id,user_id) VALUES(%s,%s)",(post_id, user_id))
         action = "liked"
-    conn.commit()
+    sconn.commit()
 
-    cur.execute("SELECT COUNT(*) as c FROM likes WHERE post_id=%s",(post_id,))
-    r = cur.fetchone()
+    scur.execute("SELECT COUNT(*) as c FROM likes WHERE post_id=%s",(post_id,))
+    r = scur.fetchone()
     like_count = r["c"] if r else 0
+    scur.close()
+    sconn.close()
 
+    bump_post_score(cur, post_id, LIKE_WEIGHT if action=="liked" else -LIKE_WEIGHT)
+    conn.commit()
     cur.close()
     conn.close()
     return jsonify({"status": action, "like_count": like_count})
@@ -413,9 +2225,11 @@ def save_api(post_id):
     row = cur.fetchone()
     if row:
         cur.execute("DELETE FROM saved_posts WHERE id=%s",(row["id"],))
+        bump_post_score(cur, post_id, -SAVE_WEIGHT)
         action = "unsaved"
     else:
         cur.execute("INSERT INTO saved_posts (post_id,user_id) VALUES(%s,%s)",(post_id, user_id))
+        bump_post_score(cur, post_id, SAVE_WEIGHT)
         action = "saved"
     conn.commit()
     cur.close()
@@ -444,8 +2258,15 @@ def delete_post(post_id):
 
     if is_admin or (row["user_id"]==user_id):
         # comments are removed automatically due to ON DELETE CASCADE
-        cur.execute("DELETE FROM likes WHERE post_id=%s",(post_id,))
+        sconn = get_db_connection(shard=shard_for_user(row["user_id"]), for_write=True)
+        scur  = sconn.cursor()
+        scur.execute("DELETE FROM likes WHERE post_id=%s",(post_id,))
+        sconn.commit()
+        scur.close()
+        sconn.close()
         cur.execute("DELETE FROM saved_posts WHERE post_id=%s",(post_id,))
+        cur.execute("DELETE FROM post_scores WHERE post_id=%s",(post_id,))
+        cur.execute("DELETE FROM comments_archive WHERE post_id=%s",(post_id,))
         cur.execute("DELETE FROM posts WHERE id=%s",(post_id,))
         conn.commit()
         flash("Post deleted!","success")
@@ -464,19 +2285,20 @@ def upload_story():
         return redirect(url_for("login"))
 
     story_file = request.files.get("story_file")
-    if story_file and story_file.filename:
+    upload_id  = request.form.get("upload_id")
+    if upload_id and not (story_file and story_file.filename):
+        fn = claim_upload(upload_id, user_id)
+        if fn:
+            _insert_story(user_id, fn)
+            flash("Story uploaded!","success")
+        else:
+            flash("Upload not found or not finished","error")
+    elif story_file and story_file.filename:
         ext = os.path.splitext(story_file.filename)[1].lower()
         if ext in ALLOWED_EXTENSIONS:
             fn = secure_filename(story_file.filename)
             story_file.save(os.path.join(app.config["UPLOAD_FOLDER"], fn))
-            conn = get_db_connection(MYSQL_DB)
-            cur = conn.cursor()
-            now = datetime.now()
-            cur.execute("""INSERT INTO stories (user_id,media_filename,created_at)
-                           VALUES(%s,%s,%s)""", (user_id, fn, now))
-            conn.commit()
-            cur.close()
-            conn.close()
+            _insert_story(user_id, fn)
             flash("Story uploaded!","success")
         else:
             flash("Invalid file extension for story","error")
@@ -485,6 +2307,17 @@ def upload_story():
 
     return redirect(url_for("feed"))
 
+def _insert_story(user_id, fn):
+    conn = get_db_connection(MYSQL_DB)
+    cur = conn.cursor()
+    now = datetime.now()
+    cur.execute("""INSERT INTO stories (user_id,media_filename,created_at)
+                   VALUES(%s,%s,%s)""", (user_id, fn, now))
+    conn.commit()
+    cur.close()
+    conn.close()
+    enqueue_transcode(fn)
+
 # =============== COMMENTS ===============
 @app.route("/comment_api/<int:post_id>", methods=["POST"])
 def add_comment_api(post_id):
@@ -505,8 +2338,9 @@ def add_comment_api(post_id):
     now = datetime.now()
     cur.execute("""INSERT INTO comments (post_id,user_id,content,created_at)
                    VALUES(%s,%s,%s,%s)""",(post_id,user_id,content,now))
-    conn.commit()
     cid = cur.lastrowid
+    bump_post_score(cur, post_id, COMMENT_WEIGHT)
+    conn.commit()
 
     # fetch the inserted row w/ user info
     cur.execute("""
@@ -540,7 +2374,10 @@ def delete_comment(comment_id):
 
     conn = get_db_connection(MYSQL_DB)
     cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT user_id,post_id FROM comments WHERE id=%s",(comment_id,))
+    cur.execute("""SELECT user_id,post_id,'comments' AS tbl FROM comments WHERE id=%s
+                   UNION ALL
+                   SELECT user_id,post_id,'comments_archive' FROM comments_archive WHERE id=%s""",
+                (comment_id, comment_id))
     row = cur.fetchone()
     if not row:
         flash("Comment not found!","error")
@@ -552,7 +2389,8 @@ def delete_comment(comment_id):
     is_admin = (current_username=="admin")
 
     if is_admin or (row["user_id"]==user_id):
-        cur.execute("DELETE FROM comments WHERE id=%s",(comment_id,))
+        cur.execute(f"DELETE FROM {row['tbl']} WHERE id=%s",(comment_id,))
+        bump_post_score(cur, row["post_id"], -COMMENT_WEIGHT)
         conn.commit()
         flash("Comment deleted!","success")
     else:
@@ -563,6 +2401,75 @@ def delete_comment(comment_id):
     return redirect(url_for("feed"))
 
 # =============== MESSAGES ===============
+# Each message is stored on both participants' shards (owner_id), so every
+# conversation read below touches only the current user's shard.
+def _user_card(cur, user_id):
+    cur.execute("SELECT id, username, profile_picture FROM users WHERE id=%s",(user_id,))
+    return cur.fetchone()
+
+def send_message(sender_id, recipient_id, content, now):
+    copies = {}
+    # a set, so a note-to-self is stored once
+    for owner_id, peer_id in {(sender_id, recipient_id), (recipient_id, sender_id)}:
+        copies.setdefault(shard_for_user(owner_id), []).append(
+            (owner_id, peer_id, sender_id, recipient_id, content, now))
+    for shard, rows in copies.items():
+        conn = get_db_connection(shard=shard, for_write=True)
+        cur  = conn.cursor()
+        cur.executemany("""INSERT INTO messages (owner_id,peer_id,sender_id,recipient_id,content,created_at)
+                           VALUES (%s, %s, %s, %s, %s, %s)""", rows)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+def fetch_conversation(user_id, other_id, before=None, before_id=None, limit=MESSAGES_PAGE_SIZE):
+    """
+    Returns up to `limit` messages older than (before, before_id), or the latest
+    ones, oldest first. Reads the hot partitions first and only falls through to
+    messages_archive when back-scroll reaches archived months.
+    """
+    shard = shard_for_user(user_id)
+    rows = []
+    for table in ("messages", "messages_archive"):
+        cond, params = "", [user_id, other_id]
+        if before is not None and before_id is not None:
+            cond = "AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [before, before, before_id]
+        elif before is not None:
+            cond = "AND created_at < %s"
+            params.append(before)
+        rows += shard_query(shard, f"""
+            SELECT id, sender_id, recipient_id, content, created_at
+            FROM {table}
+            WHERE owner_id=%s AND peer_id=%s {cond}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (*params, limit - len(rows)))
+        if len(rows) >= limit:
+            break
+        if rows:
+            before, before_id = rows[-1]["created_at"], rows[-1]["id"]
+    rows.reverse()
+    return rows
+
+def _message_dicts(msgs, people):
+    data = []
+    for msg in msgs:
+        sender    = people[msg["sender_id"]]
+        recipient = people[msg["recipient_id"]]
+        data.append({
+            "id": msg["id"],
+            "content": msg["content"],
+            "created_at": str(msg["created_at"]),
+            "sender_id": msg["sender_id"],
+            "sender_name": sender["username"],
+            "sender_profile_picture": sender["profile_picture"],
+            "recipient_id": msg["recipient_id"],
+            "recipient_name": recipient["username"],
+            "recipient_profile_picture": recipient["profile_picture"]
+        })
+    return data
+
 @app.route("/messages")
 def messages_list():
     """Show conversation partners (other users you've messaged)."""
@@ -570,19 +2477,22 @@ def messages_list():
     if not user_id:
         return redirect(url_for("login"))
 
-    conn = get_db_connection(MYSQL_DB)
-    cur  = conn.cursor(dictionary=True)
-    # Also fetch partner's profile_picture
-    cur.execute("""
-        SELECT DISTINCT u.id, u.username, u.profile_picture
-        FROM messages m
-        JOIN users u ON (u.id=m.sender_id OR u.id=m.recipient_id)
-        WHERE (m.sender_id=%s OR m.recipient_id=%s)
-          AND u.id<>%s
-    """,(user_id, user_id, user_id))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    peers = shard_query(shard_for_user(user_id), """
+        SELECT peer_id FROM messages WHERE owner_id=%s AND peer_id<>%s
+        UNION
+        SELECT peer_id FROM messages_archive WHERE owner_id=%s AND peer_id<>%s
+    """, (user_id, user_id, user_id, user_id))
+    rows = []
+    if peers:
+        conn = get_db_connection(MYSQL_DB)
+        cur  = conn.cursor(dictionary=True)
+        # Also fetch partner's profile_picture
+        placeholders = ",".join(["%s"] * len(peers))
+        cur.execute(f"SELECT id, username, profile_picture FROM users WHERE id IN ({placeholders})",
+                    tuple(p["peer_id"] for p in peers))
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
 
     conversation_partners = rows
     return render_template("messages.html",
@@ -602,9 +2512,6 @@ def direct_messages(username):
 
     other_id = other_user["id"]
 
-    conn = get_db_connection(MYSQL_DB)
-    cur  = conn.cursor(dictionary=True)
-
     # If user sends a new message
     if request.method=="POST":
         content = request.form.get("content","").strip()
@@ -615,54 +2522,40 @@ def direct_messages(username):
                 return redirect(url_for("direct_messages",username=username))
             content = censor_offensive(content)
             now = datetime.now()
-            cur.execute("""INSERT INTO messages (sender_id,recipient_id,content,created_at)
-                           VALUES (%s, %s, %s, %s)""",(user_id,other_id,content,now))
-            conn.commit()
+            send_message(user_id, other_id, content, now)
 
     # Now fetch the conversation, including each sender's profile_picture
-    cur.execute("""
-        SELECT m.*,
-               s.username AS sender_name,
-               s.profile_picture AS sender_profile_picture,
-               r.username AS recipient_name,
-               r.profile_picture AS recipient_profile_picture
-        FROM messages m
-        JOIN users s ON s.id = m.sender_id
-        JOIN users r ON r.id = m.recipient_id
-        WHERE (m.sender_id=%s AND m.recipient_id=%s)
-           OR (m.sender_id=%s AND m.recipient_id=%s)
-        ORDER BY m.created_at ASC
-    """,(user_id,other_id,other_id,user_id))
-    msgs = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    messages_list = []
-    for msg in msgs:
-        messages_list.append({
-            "id": msg["id"],
-            "content": msg["content"],
-            "created_at": str(msg["created_at"]),
-            "sender_id": msg["sender_id"],
-            "sender_name": msg["sender_name"],
-            "sender_profile_picture": msg["sender_profile_picture"],
-            "recipient_id": msg["recipient_id"],
-            "recipient_name": msg["recipient_name"],
-            "recipient_profile_picture": msg["recipient_profile_picture"]
-        })
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    people = {user_id: _user_card(cur, user_id), other_id: other_user}
+    cur.close()
+    conn.close()
+    messages_list = _message_dicts(fetch_conversation(user_id, other_id), people)
 
     return render_template("messages.html",
                            conversation=True,
                            other_user=other_user,
-                           messages_list=messages_list)
+                           messages_list=messages_list,
+                           page_size=MESSAGES_PAGE_SIZE)
 
 @app.route("/messages_api/<username>")
 def messages_api(username):
-    """Returns JSON of messages for auto-refresh in the front end."""
+    """
+    Returns JSON of the latest messages for auto-refresh in the front end, or with
+    ?before=<created_at>&before_id=<id>, the page preceding that message (back-scroll).
+    """
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({"error":"Not logged in"}),403
 
+    before = request.args.get("before")
+    before_id = request.args.get("before_id", type=int)
+    if before:
+        try:
+            before = datetime.fromisoformat(before)
+        except ValueError:
+            return jsonify({"error":"Invalid 'before' timestamp"}),400
+
     other_user = get_user_by_username(username)
     if not other_user:
         return jsonify({"error":"User not found"}),404
@@ -671,38 +2564,14 @@ def messages_api(username):
 
     conn = get_db_connection(MYSQL_DB)
     cur  = conn.cursor(dictionary=True)
-
-    # Same join for sender's pfp
-    cur.execute("""
-        SELECT m.*,
-               s.username AS sender_name,
-               s.profile_picture AS sender_profile_picture,
-               r.username AS recipient_name,
-               r.profile_picture AS recipient_profile_picture
-        FROM messages m
-        JOIN users s ON s.id = m.sender_id
-        JOIN users r ON r.id = m.recipient_id
-        WHERE (m.sender_id=%s AND m.recipient_id=%s)
-           OR (m.sender_id=%s AND m.recipient_id=%s)
-        ORDER BY m.created_at ASC
-    """,(user_id,other_id,other_id,user_id))
-    msgs = cur.fetchall()
+    people = {user_id: _user_card(cur, user_id), other_id: other_user}
     cur.close()
     conn.close()
 
-    data = []
-    for msg in msgs:
-        data.append({
-            "id": msg["id"],
-            "content": msg["content"],
-            "created_at": str(msg["created_at"]),
-            "sender_id": msg["sender_id"],
-            "sender_name": msg["sender_name"],
-            "sender_profile_picture": msg["sender_profile_picture"],
-            "recipient_id": msg["recipient_id"],
-            "recipient_name": msg["recipient_name"]
-        })
-    return jsonify({"messages": data})
+    data = _message_dicts(fetch_conversation(user_id, other_id, before or None, before_id), people)
+    for d in data:
+        d.pop("recipient_profile_picture")
+    return jsonify({"messages": data, "has_more": len(data) >= MESSAGES_PAGE_SIZE})
 
 # =============== PROFILE ===============
 @app.route("/profile", methods=["GET","POST"])
@@ -740,6 +2609,14 @@ def _edit_profile_logic(target_user_id, is_admin=False):
                 fn = secure_filename(pfp_file.filename)
                 pfp_file.save(os.path.join(app.config["UPLOAD_FOLDER"], fn))
                 cur.execute("UPDATE users SET profile_picture=%s WHERE id=%s",(fn,target_user_id))
+        elif request.form.get("upload_id"):
+            fn = claim_upload(request.form["upload_id"], get_current_user_id())
+            if not fn:
+                cur.close()
+                conn.close()
+                flash("Upload not found or not finished","error")
+                return redirect(request.path)
+            cur.execute("UPDATE users SET profile_picture=%s WHERE id=%s",(fn,target_user_id))
 
         cur.execute("UPDATE users SET bio=%s WHERE id=%s",(new_bio,target_user_id))
         conn.commit()
@@ -749,33 +2626,31 @@ def _edit_profile_logic(target_user_id, is_admin=False):
         cur.execute("SELECT * FROM users WHERE id=%s",(target_user_id,))
         user = cur.fetchone()
 
-    # user posts
+    cur.execute("SELECT COUNT(*) as c FROM posts WHERE user_id=%s",(target_user_id,))
+    user_post_count = cur.fetchone()["c"]
+    follower_count, following_count = get_follow_counts(cur, target_user_id)
+
+    # precomputed by compute_follow_suggestions()
     cur.execute("""
+        SELECT u.id, u.username, u.profile_picture, fs.mutuals
+        FROM follow_suggestions fs
+        JOIN users u ON u.id=fs.suggested_id
+        WHERE fs.user_id=%s
+        ORDER BY fs.mutuals DESC
+    """,(target_user_id,))
+    suggestions = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    # user posts + saved, streamed into the template
+    posts = iter_post_tiles("""
         SELECT p.*, u.username, u.profile_picture
         FROM posts p
         JOIN users u ON p.user_id=u.id
         WHERE p.user_id=%s
         ORDER BY p.created_at DESC
     """,(target_user_id,))
-    raw_posts = cur.fetchall()
-
-    posts = []
-    for p in raw_posts:
-        cur.execute("SELECT COUNT(*) as c FROM likes WHERE post_id=%s",(p["id"],))
-        lr = cur.fetchone()
-        like_count = lr["c"] if lr else 0
-        posts.append({
-            "id": p["id"],
-            "content": p["content"],
-            "media_filename": p["media_filename"],
-            "created_at": p["created_at"],
-            "username": p["username"],
-            "profile_picture": p["profile_picture"],
-            "like_count": like_count
-        })
-
-    # saved
-    cur.execute("""
+    saved_posts = iter_post_tiles("""
         SELECT p.*, u.username, u.profile_picture
         FROM saved_posts s
         JOIN posts p ON p.id=s.post_id
@@ -783,33 +2658,34 @@ def _edit_profile_logic(target_user_id, is_admin=False):
         WHERE s.user_id=%s
         ORDER BY p.created_at DESC
     """,(target_user_id,))
-    raw_saved = cur.fetchall()
-
-    saved_posts = []
-    for sp in raw_saved:
-        cur.execute("SELECT COUNT(*) as c FROM likes WHERE post_id=%s",(sp["id"],))
-        lr = cur.fetchone()
-        lc = lr["c"] if lr else 0
-        saved_posts.append({
-            "id": sp["id"],
-            "content": sp["content"],
-            "media_filename": sp["media_filename"],
-            "created_at": sp["created_at"],
-            "username": sp["username"],
-            "profile_picture": sp["profile_picture"],
-            "like_count": lc
-        })
-
-    user_post_count = len(posts)
-    cur.close()
-    conn.close()
 
-    return render_template("profile.html",
-                           user=user,
-                           posts=posts,
-                           saved_posts=saved_posts,
-                           user_post_count=user_post_count,
-                           is_admin_edit=is_admin)
+    resp = render_page("profile.html",
+                       user=user,
+                       posts=posts,
+                       saved_posts=saved_posts,
+                       user_post_count=user_post_count,
+                       follower_count=follower_count,
+                       following_count=following_count,
+                       suggestions=suggestions,
+                       is_admin_edit=is_admin)
+    resp.call_on_close(posts.close)
+    resp.call_on_close(saved_posts.close)
+    return resp
+
+def iter_post_tiles(query, params):
+    """Yields profile grid tiles (post + like count) for the rows of `query`."""
+    for batch in iter_batches(stream_rows(query, params), STREAM_BATCH_SIZE):
+        likes = like_stats(batch)
+        for p in batch:
+            yield {
+                "id": p["id"],
+                "content": p["content"],
+                "media_filename": p["media_filename"],
+                "created_at": p["created_at"],
+                "username": p["username"],
+                "profile_picture": p["profile_picture"],
+                "like_count": likes.get(p["id"], (0, False))[0]
+            }
 
 @app.route("/user/<username>")
 def user_profile(username):
@@ -831,6 +2707,14 @@ def user_profile(username):
         ORDER BY p.created_at DESC
     """,(username,))
     raw_posts = cur.fetchall()
+
+    follower_count, following_count = get_follow_counts(cur, user["id"])
+    is_following = False
+    current_id = get_current_user_id()
+    if current_id and current_id!=user["id"]:
+        cur.execute("SELECT 1 AS f FROM follows WHERE follower_id=%s AND followee_id=%s",
+                    (current_id, user["id"]))
+        is_following = cur.fetchone() is not None
     cur.close()
     conn.close()
 
@@ -849,7 +2733,424 @@ def user_profile(username):
     return render_template("user_profile.html",
                            user=user,
                            posts=posts,
-                           user_post_count=user_post_count)
+                           user_post_count=user_post_count,
+                           follower_count=follower_count,
+                           following_count=following_count,
+                           is_following=is_following)
+
+# =============== RESUMABLE UPLOADS ===============
+def _partial_path(upload_id):
+    return os.path.join(UPLOAD_TMP_FOLDER, upload_id + ".part")
+
+def _load_upload_session(upload_id, user_id):
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute("SELECT * FROM upload_sessions WHERE id=%s AND user_id=%s",(upload_id, user_id))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row
+
+def _upload_status(sess, offset=None):
+    return {
+        "upload_id": sess["id"],
+        "offset": sess["received"] if offset is None else offset,
+        "size": sess["total_size"],
+        "status": sess["status"],
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    }
+
+@app.route("/upload_api", methods=["POST"])
+def create_upload():
+    """Opens a resumable upload session for a file of a declared size."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error":"Not logged in"}),403
+
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get("filename",""))
+    try:
+        size = int(data.get("size",0))
+    except (TypeError, ValueError):
+        size = 0
+    ext = os.path.splitext(filename)[1].lower()
+    if not filename or ext not in ALLOWED_EXTENSIONS:
+        return jsonify({"error":"Invalid file extension"}),400
+    if size <= 0 or size > MAX_UPLOAD_SIZE:
+        return jsonify({"error":f"File size must be between 1 and {MAX_UPLOAD_SIZE} bytes"}),413
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(UPLOAD_TMP_FOLDER, exist_ok=True)
+    open(_partial_path(upload_id), "wb").close()
+
+    now = datetime.now()
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""INSERT INTO upload_sessions
+                   (id,user_id,filename,total_size,received,status,created_at,updated_at)
+                   VALUES (%s,%s,%s,%s,0,'open',%s,%s)""",
+                (upload_id, user_id, f"{upload_id[:12]}_{filename}", size, now, now))
+    conn.commit()
+    cur.close()
+    conn.close()
+    return jsonify({"upload_id": upload_id, "offset": 0, "size": size,
+                    "status": "open", "chunk_size": UPLOAD_CHUNK_SIZE}),201
+
+@app.route("/upload_api/<upload_id>", methods=["GET"])
+def upload_progress(upload_id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error":"Not logged in"}),403
+    sess = _load_upload_session(upload_id, user_id)
+    if not sess:
+        return jsonify({"error":"Upload not found"}),404
+    return jsonify(_upload_status(sess))
+
+@app.route("/upload_api/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """
+    Appends the request body at the `Upload-Offset` header position. The body is
+    copied to disk in small blocks, and no DB connection is held while it arrives.
+    Bytes received before a dropped connection are kept, so the client resumes
+    from the offset returned by GET.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error":"Not logged in"}),403
+
+    offset = request.headers.get("Upload-Offset", type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        return jsonify({"error":"Upload-Offset and Content-Length are required"}),400
+    if length > UPLOAD_CHUNK_SIZE:
+        return jsonify({"error":f"Chunks must be <= {UPLOAD_CHUNK_SIZE} bytes"}),413
+
+    sess = _load_upload_session(upload_id, user_id)
+    if not sess or sess["status"]!="open":
+        return jsonify({"error":"Upload not found"}),404
+    if offset!=sess["received"]:
+        return jsonify(_upload_status(sess)),409
+    if offset + length > sess["total_size"]:
+        return jsonify({"error":"Chunk exceeds declared file size"}),413
+
+    written = 0
+    with open(_partial_path(upload_id), "r+b") as f:
+        f.seek(offset)
+        f.truncate()
+        try:
+            while written < length:
+                block = request.stream.read(min(UPLOAD_READ_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+        except ClientDisconnected:
+            pass
+
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""UPDATE upload_sessions SET received=%s, updated_at=%s
+                   WHERE id=%s AND received=%s AND status='open'""",
+                (offset + written, datetime.now(), upload_id, offset))
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    if not updated:
+        # another request moved the offset first
+        return jsonify(_upload_status(_load_upload_session(upload_id, user_id))),409
+    return jsonify(_upload_status(sess, offset + written))
+
+@app.route("/upload_api/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    """Moves a fully received upload into UPLOAD_FOLDER so posts/stories/profiles can use it."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error":"Not logged in"}),403
+
+    sess = _load_upload_session(upload_id, user_id)
+    if not sess:
+        return jsonify({"error":"Upload not found"}),404
+    if sess["status"]!="open":
+        return jsonify(_upload_status(sess))
+    if sess["received"]!=sess["total_size"]:
+        return jsonify(_upload_status(sess)),409
+
+    # flip the status first so a concurrent finalize can't move the file twice
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""UPDATE upload_sessions SET status='finalized', updated_at=%s
+                   WHERE id=%s AND status='open'""", (datetime.now(), upload_id))
+    claimed = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+    if claimed:
+        shutil.move(_partial_path(upload_id),
+                    os.path.join(app.config["UPLOAD_FOLDER"], sess["filename"]))
+    sess["status"] = "finalized"
+    return jsonify(_upload_status(sess))
+
+def claim_upload(upload_id, user_id):
+    """Returns the stored filename of a finalized upload owned by `user_id`, at most once."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    cur.execute("""UPDATE upload_sessions SET status='attached', updated_at=%s
+                   WHERE id=%s AND user_id=%s AND status='finalized'""",
+                (datetime.now(), upload_id, user_id))
+    fn = None
+    if cur.rowcount:
+        cur.execute("SELECT filename FROM upload_sessions WHERE id=%s",(upload_id,))
+        fn = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return fn
+
+def cleanup_upload_sessions():
+    """Drops sessions idle for UPLOAD_SESSION_TTL along with their unattached files."""
+    cutoff = datetime.now() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor()
+    while True:
+        cur.execute("""SELECT id, filename, status FROM upload_sessions
+                       WHERE updated_at < %s LIMIT 500""", (cutoff,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        for upload_id, filename, status in rows:
+            if status == "open":
+                path = _partial_path(upload_id)
+            elif status == "finalized":
+                path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+            else:
+                path = None
+            if path and os.path.exists(path):
+                os.remove(path)
+        cur.executemany("DELETE FROM upload_sessions WHERE id=%s", [(r[0],) for r in rows])
+        conn.commit()
+    cur.close()
+    conn.close()
+
+# =============== FOLLOWS ===============
+@app.route("/follow_api/<username>", methods=["POST"])
+def follow_api(username):
+    """Toggles following `username`; counters are adjusted only when a row really changed."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error":"Not logged in"}),403
+
+    target = get_user_by_username(username)
+    if not target:
+        return jsonify({"error":"User not found"}),404
+    if target["id"]==user_id:
+        return jsonify({"error":"Cannot follow yourself"}),400
+
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute("DELETE FROM follows WHERE follower_id=%s AND followee_id=%s",
+                (user_id, target["id"]))
+    if cur.rowcount:
+        bump_follow_counts(cur, user_id, target["id"], -1)
+        action = "unfollowed"
+    else:
+        now = datetime.now()
+        cur.execute("""INSERT IGNORE INTO follows (follower_id,followee_id,created_at)
+                       VALUES (%s,%s,%s)""",(user_id, target["id"], now))
+        if cur.rowcount:
+            bump_follow_counts(cur, user_id, target["id"], 1)
+        action = "followed"
+    conn.commit()
+
+    follower_count, following_count = get_follow_counts(cur, target["id"])
+    cur.close()
+    conn.close()
+    return jsonify({"status": action,
+                    "follower_count": follower_count,
+                    "following_count": following_count})
+
+@app.route("/user/<username>/followers")
+def followers_list(username):
+    return _follow_list(username, "followers")
+
+@app.route("/user/<username>/following")
+def following_list(username):
+    return _follow_list(username, "following")
+
+def _follow_list(username, kind):
+    user = get_user_by_username(username)
+    if not user:
+        flash("User does not exist!","error")
+        return redirect(url_for("feed"))
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    if kind == "followers":
+        # served by idx_follows_followee
+        query = """
+            SELECT u.id, u.username, u.profile_picture
+            FROM follows f
+            JOIN users u ON u.id=f.follower_id
+            WHERE f.followee_id=%s
+            ORDER BY f.created_at DESC
+            LIMIT %s OFFSET %s
+        """
+    else:
+        query = """
+            SELECT u.id, u.username, u.profile_picture
+            FROM follows f
+            JOIN users u ON u.id=f.followee_id
+            WHERE f.follower_id=%s
+            ORDER BY f.created_at DESC
+            LIMIT %s OFFSET %s
+        """
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute(query, (user["id"], FOLLOW_PAGE_SIZE + 1, (page - 1) * FOLLOW_PAGE_SIZE))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    return render_template("follow_list.html",
+                           user=user,
+                           kind=kind,
+                           users=rows[:FOLLOW_PAGE_SIZE],
+                           page=page,
+                           has_next=len(rows) > FOLLOW_PAGE_SIZE)
+
+# =============== DATA EXPORT ===============
+@app.route("/export")
+def export_data():
+    user_id = get_current_user_id()
+    if not user_id:
+        return redirect(url_for("login"))
+    return _export_logic(user_id, user_id)
+
+@app.route("/admin_export/<int:target_user_id>")
+def admin_export(target_user_id):
+    if session.get("username")!="admin":
+        flash("Access denied. Admin only.","error")
+        return redirect(url_for("feed"))
+    return _export_logic(target_user_id, get_current_user_id())
+
+def _export_logic(target_user_id, requested_by):
+    """Streams small exports straight to the client; large ones become background jobs."""
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute("SELECT id, username FROM users WHERE id=%s",(target_user_id,))
+    user = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not user:
+        flash("User does not exist!","error")
+        return redirect(url_for("feed"))
+
+    if estimate_export_rows(target_user_id) <= EXPORT_INLINE_MAX_ROWS:
+        resp = Response(iter_user_export(target_user_id), mimetype="application/zip")
+        resp.headers["Content-Disposition"] = f'attachment; filename="{user["username"]}-export.zip"'
+        return resp
+
+    job_id = enqueue_export(target_user_id, requested_by)
+    flash("Your export is being prepared. It will be linked here when ready.","success")
+    return redirect(url_for("export_status", job_id=job_id))
+
+def _load_export_job(job_id):
+    """Returns the export job if the current user requested it (or is admin)."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return None
+    conn = get_db_connection(MYSQL_DB)
+    cur  = conn.cursor(dictionary=True)
+    cur.execute("""SELECT j.*, u.username FROM export_jobs j
+                   JOIN users u ON u.id=j.user_id
+                   WHERE j.id=%s""",(job_id,))
+    job = cur.fetchone()
+    cur.close()
+    conn.close()
+    if job and (job["requested_by"]==user_id or session.get("username")=="admin"):
+        if job["status"] in ("pending", "running") and job["created_at"] < export_stale_cutoff():
+            job["status"] = "failed"
+        return job
+    return None
+
+@app.route("/export/<job_id>")
+def export_status(job_id):
+    job = _load_export_job(job_id)
+    if not job:
+        flash("Export not found.","error")
+        return redirect(url_for("feed"))
+    return render_template("export_status.html", job=job)
+
+@app.route("/export/<job_id>/download")
+def download_export(job_id):
+    job = _load_export_job(job_id)
+    if not job or job["status"]!="ready":
+        flash("Export not available.","error")
+        return redirect(url_for("feed"))
+    return send_from_directory(os.path.abspath(EXPORT_FOLDER), f"{job_id}.zip",
+                               as_attachment=True,
+                               download_name=f"{job['username']}-export.zip")
+
+# =============== ADMIN PROFILER ===============
+@app.route("/admin/profiler", methods=["GET","POST"])
+def profiler_status():
+    """
+    GET: settings + recent captures. POST (form or JSON): `rate` (0-1),
+    `endpoint` + `seconds` to sample every request of one route for a while,
+    `slow_ms` to keep only slower captures, `clear` to drop captures.
+    """
+    if session.get("username")!="admin":
+        return jsonify({"error":"Admin only"}),403
+
+    if request.method=="POST":
+        data = request.get_json(silent=True) or request.form
+        try:
+            if "rate" in data:
+                _profile_settings["rate"] = min(max(float(data["rate"]), 0.0), 1.0)
+            if "slow_ms" in data:
+                _profile_settings["slow_ms"] = max(float(data["slow_ms"]), 0.0)
+            if data.get("endpoint"):
+                if data["endpoint"] not in app.view_functions:
+                    return jsonify({"error":"Unknown endpoint"}),400
+                _profile_settings["endpoint"] = data["endpoint"]
+                _profile_settings["until"] = time.time() + float(data.get("seconds", 60))
+        except (TypeError, ValueError):
+            return jsonify({"error":"Invalid profiler settings"}),400
+        if data.get("clear"):
+            _profile_captures.clear()
+
+    window = max(_profile_settings["until"] - time.time(), 0)
+    return jsonify({
+        "rate": _profile_settings["rate"],
+        "slow_ms": _profile_settings["slow_ms"],
+        "endpoint": _profile_settings["endpoint"] if window else None,
+        "endpoint_seconds_left": round(window, 1),
+        "captures": [_capture_summary(p) for p in reversed(list(_profile_captures))]
+    })
+
+@app.route("/admin/profiler/folded")
+def profiler_folded():
+    """Folded stacks of all captures (optionally `?endpoint=`), for flamegraph.pl/speedscope."""
+    if session.get("username")!="admin":
+        return jsonify({"error":"Admin only"}),403
+    endpoint = request.args.get("endpoint")
+    captures = [p for p in list(_profile_captures) if not endpoint or p["endpoint"]==endpoint]
+    return Response(folded_stacks(captures), mimetype="text/plain")
+
+@app.route("/admin/profiler/<capture_id>")
+def profiler_capture(capture_id):
+    """One capture: SQL statements with timings, plus its stacks (`?format=folded`)."""
+    if session.get("username")!="admin":
+        return jsonify({"error":"Admin only"}),403
+    prof = next((p for p in list(_profile_captures) if p["id"]==capture_id), None)
+    if not prof:
+        return jsonify({"error":"Capture not found"}),404
+    if request.args.get("format")=="folded":
+        return Response(folded_stacks([prof]), mimetype="text/plain")
+    summary = _capture_summary(prof)
+    summary["sql"] = prof["sql"]
+    summary["sql_dropped"] = prof["sql_dropped"]
+    return jsonify(summary)
 
 @app.route("/uploads/<filename>")
 def uploads(filename):
@@ -862,4 +3163,8 @@ if __name__=="__main__":
     # Initialize DB & ensure admin user only when running directly
     init_db()
     ensure_admin_exists()
+    # debug=True runs the app in a reloader child; the parent process stays
+    # alive, so jobs start only in the serving process to avoid running twice
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_jobs()
     app.run(host="0.0.0.0", port=5001, debug=True)
@@ -11,8 +11,25 @@ function showFilename(input, labelId) {
   }
 }
 
+// Play the adaptive HLS stream when one is ready; otherwise the original
+// file in `src` stays as the fallback.
+function attachHls(video, hlsUrl) {
+  if (!hlsUrl) return;
+  if (video.canPlayType("application/vnd.apple.mpegurl")) {
+    video.src = hlsUrl;
+  } else if (window.Hls && Hls.isSupported()) {
+    const hls = new Hls();
+    hls.loadSource(hlsUrl);
+    hls.attachMedia(video);
+  }
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  document.querySelectorAll("video[data-hls]").forEach(v => attachHls(v, v.dataset.hls));
+});
+
 // For story modal
-function openStoryModal(mediaUrl, username) {
+function openStoryModal(mediaUrl, username, hlsUrl) {
   const modal = document.getElementById("storyModal");
   const closeBtn = document.getElementById("closeModal") || document.querySelector(".close");
   const modalMedia = document.getElementById("modalMedia");
@@ -30,6 +47,7 @@ function openStoryModal(mediaUrl, username) {
     const vid = document.createElement("video");
     vid.src = mediaUrl;
     vid.controls = true;
+    attachHls(vid, hlsUrl);
     modalMedia.appendChild(vid);
   } else {
     const p = document.createElement("p");
@@ -54,3 +72,86 @@ function openStoryModal(mediaUrl, username) {
     }
   };
 }
+
+// ---------- RESUMABLE UPLOADS ----------
+// Large videos are sent in chunks through /upload_api so a dropped connection
+// resumes from the last acknowledged offset instead of starting over.
+const RESUMABLE_MIN_SIZE = 8 * 1024 * 1024;
+
+async function resumableUpload(file, onProgress) {
+  const key = `upload:${file.name}:${file.size}:${file.lastModified}`;
+  let uploadId = localStorage.getItem(key);
+  let state = null;
+
+  if (uploadId) {
+    const r = await fetch(`/upload_api/${uploadId}`);
+    state = r.ok ? await r.json() : null;
+    if (!state || state.status !== "open") {
+      uploadId = null;
+    }
+  }
+  if (!uploadId) {
+    const r = await fetch('/upload_api', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    state = await r.json();
+    if (!r.ok) throw new Error(state.error);
+    uploadId = state.upload_id;
+    localStorage.setItem(key, uploadId);
+  }
+
+  let offset = state.offset;
+  while (offset < file.size) {
+    let r;
+    try {
+      r = await fetch(`/upload_api/${uploadId}`, {
+        method: 'PUT',
+        headers: { 'Upload-Offset': offset, 'Content-Type': 'application/octet-stream' },
+        body: file.slice(offset, offset + state.chunk_size)
+      });
+    } catch (err) {
+      // connection dropped mid-chunk: wait, then ask the server where to resume
+      await new Promise(res => setTimeout(res, 2000));
+      r = await fetch(`/upload_api/${uploadId}`);
+    }
+    const data = await r.json();
+    if (!r.ok && r.status !== 409) throw new Error(data.error);
+    offset = data.offset;
+    if (onProgress) onProgress(offset, file.size);
+  }
+
+  const r = await fetch(`/upload_api/${uploadId}/finalize`, { method: 'POST' });
+  const data = await r.json();
+  if (!r.ok) throw new Error(data.error || "Upload could not be finalized");
+  localStorage.removeItem(key);
+  return uploadId;
+}
+
+// Form onsubmit hook: big video files go through resumableUpload, then the
+// form is submitted with only the finished upload_id.
+function submitWithResumableUpload(ev, inputName) {
+  const form = ev.target;
+  const input = form.querySelector(`input[name="${inputName}"]`);
+  const file = input && input.files && input.files[0];
+  if (!file || !file.type.startsWith("video/") || file.size < RESUMABLE_MIN_SIZE) {
+    return true;
+  }
+  ev.preventDefault();
+  const label = input.nextElementSibling;
+  resumableUpload(file, (done, total) => {
+    if (label) label.textContent = `Uploading ${Math.floor(done * 100 / total)}%`;
+  })
+    .then(uploadId => {
+      const hidden = document.createElement("input");
+      hidden.type = "hidden";
+      hidden.name = "upload_id";
+      hidden.value = uploadId;
+      form.appendChild(hidden);
+      input.value = "";
+      form.submit();
+    })
+    .catch(err => alert(`Upload failed: ${err.message}`));
+  return false;
+}
@@ -1,5 +1,15 @@
 import unittest
 import os
+import io
+import json
+import gzip
+import re
+import math
+import sqlite3
+import tempfile
+import subprocess
+from unittest import mock
+from concurrent.futures import Future
 import app
 
 class TestApp(unittest.TestCase):
@@ -28,5 +38,445 @@ class TestApp(unittest.TestCase):
     #     censored = app.censor_offensive(text)
     #     self.assertIn("****", censored)
 
+    def test_gzip_json_response(self):
+        with app.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            resp = app.jsonify({"content": "x" * 2000})
+            resp = app.compress_response(resp)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertIn(b"xxxx", gzip.decompress(resp.get_data()))
+
+    def test_like_stats_one_query_per_shard(self):
+        calls = []
+
+        def fake_query(shard, query, params):
+            calls.append((shard, params))
+            return [{"post_id": pid, "c": 1, "mine": 0} for pid in params[1:]]
+
+        posts = [{"id": 10, "user_id": 1}, {"id": 11, "user_id": 3}, {"id": 12, "user_id": 2}]
+        with mock.patch.object(app, "LOGICAL_SHARDS", 2), \
+             mock.patch.object(app, "shard_query", fake_query):
+            stats = app.like_stats(posts, user_id=7)
+        self.assertEqual(sorted(calls), [(0, (7, 12)), (1, (7, 10, 11))])
+        self.assertEqual(stats[11], (1, False))
+
+    def test_month_partition_defs_cross_year(self):
+        defs = app._partition_defs(app.datetime(2026, 11, 20), app.datetime(2027, 1, 1))
+        self.assertEqual(defs, [
+            "PARTITION p202611 VALUES LESS THAN ('2026-12-01')",
+            "PARTITION p202612 VALUES LESS THAN ('2027-01-01')",
+            "PARTITION p202701 VALUES LESS THAN ('2027-02-01')",
+        ])
+
+    def test_user_export_zip_stream(self):
+        def fake_rows(query, params=(), shard=None, fetch_size=None):
+            if "FROM posts" in query:
+                yield {"id": 1, "content": "hi", "media_filename": None, "created_at": "2026-01-01"}
+
+        with mock.patch.object(app, "stream_rows", fake_rows):
+            data = b"".join(app.iter_user_export(5))
+        with app.zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIn("messages.ndjson", zf.namelist())
+            self.assertEqual(json.loads(zf.read("posts.ndjson"))["content"], "hi")
+
+    def test_profiler_captures_sampled_request(self):
+        client = app.app.test_client()
+        with mock.patch.dict(app._profile_settings, {"rate": 1.0, "slow_ms": 0}):
+            client.get("/").close()
+            with client.session_transaction() as sess:
+                sess["username"] = "admin"
+            captures = client.get("/admin/profiler").get_json()["captures"]
+        self.assertEqual(captures[0]["endpoint"], "home")
+        self.assertEqual(app.folded_stacks([{"endpoint": "home", "stacks": {"a:f;b:g": 3}}]),
+                         "home;a:f;b:g 3\n")
+
+    def test_memory_token_bucket_refills(self):
+        buckets = app.MemoryBuckets()
+        self.assertEqual(buckets.take("k", 2, 1.0, now=0), 0)
+        self.assertEqual(buckets.take("k", 2, 1.0, now=0), 0)
+        self.assertAlmostEqual(buckets.take("k", 2, 1.0, now=0.5), 0.5)
+        self.assertEqual(buckets.take("k", 2, 1.0, now=1.5), 0)
+
+    def test_rate_limited_api_returns_429(self):
+        client = app.app.test_client()
+        with mock.patch.object(app, "RATE_LIMITER", app.MemoryBuckets()), \
+             mock.patch.dict(app.RATE_LIMITS, {"like_api": (1, 0.1)}):
+            self.assertEqual(client.post("/like_api/1").status_code, 403)
+            resp = client.post("/like_api/1")
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "10")
+
+    def test_copy_rows_filtered_to_shard(self):
+        src, dst = mock.MagicMock(), mock.MagicMock()
+        scur = src.cursor.return_value
+        scur.column_names = ("id", "post_id", "user_id")
+        scur.fetchall.side_effect = [[(4, 9, 1), (7, 9, 2)], []]
+        table, source, where = app.UNSHARDED_MIGRATIONS[0]
+        last_id = app._copy_new_rows(src, dst, table, 0, 100, source, where, (4, 3))
+
+        self.assertEqual(last_id, 7)
+        sql, params = scur.execute.call_args_list[0][0]
+        self.assertIn("JOIN posts p", sql)
+        self.assertEqual(params, (0, 4, 3, 100))
+        dst.cursor.return_value.executemany.assert_called_once()
+
+    def test_profiler_records_shard_query_once(self):
+        prof = {"sql": [], "sql_dropped": 0}
+        tid = app.threading.get_ident()
+        with mock.patch.object(app.mysql.connector, "connect"), \
+             mock.patch.dict(app._active_profiles, {tid: prof}):
+            app.shard_query(0, "SELECT 1")
+        self.assertEqual([q["sql"] for q in prof["sql"]], ["SELECT 1"])
+
+    def test_enqueue_export_ignores_stale_jobs(self):
+        conn = mock.MagicMock()
+        cur = conn.cursor.return_value
+        cur.fetchone.return_value = None
+        with mock.patch.object(app, "get_db_connection", return_value=conn), \
+             mock.patch.object(app, "_export_pool", mock.MagicMock()), \
+             mock.patch.object(app.os, "makedirs"):
+            job_id = app.enqueue_export(5, 5)
+        sql, params = cur.execute.call_args_list[0][0]
+        self.assertIn("created_at >= %s", sql)
+        self.assertLess(params[1], app.datetime.now())
+        self.assertEqual(cur.execute.call_args_list[1][0][1][0], job_id)
+
+    def test_login_name_bucket_charged_only_on_failure(self):
+        buckets = app.MemoryBuckets()
+        with mock.patch.object(app, "RATE_LIMITER", buckets), \
+             mock.patch.dict(app.RATE_LIMITS, {"login_name": (1, 0.01)}):
+            with app.app.test_request_context("/login", method="POST", data={"username": "Bob"}):
+                keys = app._rate_limit_keys("login")
+            self.assertEqual(keys[1], ("login:name:bob", 0, "login_name"))
+            self.assertEqual(buckets.take("login:name:bob", 1, 0.01, cost=0), 0)
+            self.assertEqual(buckets.take("login:name:bob", 1, 0.01, cost=0), 0)
+            app.charge_failed_login("Bob")
+            self.assertGreater(buckets.take("login:name:bob", 1, 0.01, cost=0), 0)
+
+    def test_one_ip_cannot_lock_out_a_username(self):
+        client = app.app.test_client()
+        clock = [0.0]
+        buckets = app.MemoryBuckets()
+        conn = mock.MagicMock()
+        conn.cursor.return_value.fetchone.return_value = None  # every attempt fails
+        statuses = set()
+        with mock.patch.object(app, "RATE_LIMITER", buckets), \
+             mock.patch.object(app.time, "monotonic", lambda: clock[0]), \
+             mock.patch.object(app, "get_db_connection", return_value=conn):
+            # one attacker IP hammering a single account for 30 minutes
+            while clock[0] < 1800:
+                resp = client.post("/login", data={"username": "bob", "password": "x"})
+                statuses.add(resp.status_code)
+                clock[0] += 5
+            name_wait = buckets.take("login:name:bob", *app.RATE_LIMITS["login_name"], cost=0)
+        self.assertEqual(statuses, {200, 429})
+        self.assertEqual(name_wait, 0)
+    def test_hls_js_only_on_video_pages(self):
+        with app.app.test_request_context():
+            login_page = app.render_template("login.html")
+            self.assertNotIn("hls.js", login_page)
+            posts_page = app.render_template("user_profile.html", user={"username": "bob"}, posts=[],
+                                             user_post_count=0, follower_count=0,
+                                             following_count=0, is_following=False)
+            self.assertIn('<script defer src="%s"' % app.HLS_JS_URL, posts_page)
+
+    def test_feed_post_with_unclaimed_upload_is_rejected(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        conn = mock.MagicMock()
+        with mock.patch.object(app, "get_db_connection", return_value=conn), \
+             mock.patch.object(app, "claim_upload", return_value=None):
+            resp = client.post("/feed", data={"content": "hello", "upload_id": "abc"})
+        self.assertEqual(resp.status_code, 302)
+        conn.cursor.return_value.execute.assert_not_called()
+        with client.session_transaction() as sess:
+            self.assertEqual(sess["_flashes"], [("error", "Upload not found or not finished")])
+
+    def _score_db(self):
+        """
+        Runs the app's post_scores SQL on sqlite, with MySQL's NOW/TIMESTAMPDIFF/
+        upsert mapped onto a fake clock in seconds.
+        """
+        db = sqlite3.connect(":memory:")
+        clock = [0.0]
+        db.create_function("NOW", 0, lambda: clock[0])
+        db.create_function("POW", 2, math.pow)
+        db.create_function("GREATEST", 2, max)
+        db.execute("CREATE TABLE post_scores (post_id INTEGER PRIMARY KEY, score REAL, decayed_at REAL)")
+
+        class Cursor:
+            def __init__(self):
+                self._cur = db.cursor()
+
+            def execute(self, sql, params=()):
+                sql = re.sub(r"TIMESTAMPDIFF\(SECOND, (\w+), NOW\(\)\)", r"(NOW() - \1)", sql)
+                sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT(post_id) DO UPDATE SET")
+                return self._cur.execute(sql.replace("%s", "?"), params)
+
+            def __getattr__(self, name):
+                return getattr(self._cur, name)
+
+        conn = mock.MagicMock()
+        conn.cursor.side_effect = Cursor
+        conn.commit.side_effect = db.commit
+
+        def score_at(post_id, t):
+            score, decayed_at = db.execute("SELECT score, decayed_at FROM post_scores WHERE post_id=?",
+                                           (post_id,)).fetchone()
+            return score * 0.5 ** ((t - decayed_at) / (app.EXPLORE_HALF_LIFE_HOURS * 3600))
+        return conn, clock, score_at
+
+    def test_post_score_decay_independent_of_rescore_timing(self):
+        hour = 3600.0
+        half_life = app.EXPLORE_HALF_LIFE_HOURS * hour
+        expected = 1.0 * 0.5 ** (48 * hour / half_life) + 3.0 * 0.5 ** (18 * hour / half_life)
+        # (time in hours, action): post at 0h, like+save at 30h, scored at 48h
+        for rescores in ([], [10], [10, 30], [40]):
+            conn, clock, score_at = self._score_db()
+            events = [(0, "post"), (30, "engage")] + [(h, "rescore") for h in rescores]
+            with self.subTest(rescores=rescores), \
+                 mock.patch.object(app, "get_db_connection", return_value=conn):
+                for h, action in sorted(events):
+                    clock[0] = h * hour
+                    if action == "post":
+                        app.bump_post_score(conn.cursor(), 1, app.POST_BASE_SCORE)
+                    elif action == "engage":
+                        app.bump_post_score(conn.cursor(), 1, app.LIKE_WEIGHT)
+                        app.bump_post_score(conn.cursor(), 1, app.SAVE_WEIGHT)
+                    else:
+                        app.rescore_post_scores(batch_size=1)
+                self.assertAlmostEqual(score_at(1, 48 * hour), expected)
+
+    def test_rescore_prunes_cold_posts_across_batches(self):
+        conn, clock, score_at = self._score_db()
+        with mock.patch.object(app, "get_db_connection", return_value=conn):
+            for post_id in (1, 2, 3):
+                app.bump_post_score(conn.cursor(), post_id, app.POST_BASE_SCORE)
+            clock[0] = 20 * app.EXPLORE_HALF_LIFE_HOURS * 3600  # ~1e-6 of the base score
+            app.bump_post_score(conn.cursor(), 3, app.COMMENT_WEIGHT)
+            app.rescore_post_scores(batch_size=2)
+        cur = conn.cursor()
+        cur.execute("SELECT post_id FROM post_scores")
+        self.assertEqual(cur.fetchall(), [(3,)])
+        self.assertAlmostEqual(score_at(3, clock[0]), app.COMMENT_WEIGHT, places=4)
+
+    def test_engagement_bumps_post_score(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        conn = mock.MagicMock()
+        cur = conn.cursor.return_value
+        cases = [
+            ("/like_api/7", {}, [{"user_id": 3}, None, {"c": 1}], app.LIKE_WEIGHT),
+            ("/save_api/7", {}, [None], app.SAVE_WEIGHT),
+            ("/comment_api/7", {"comment_content": "nice"},
+             [{"id": 1, "post_id": 7, "user_id": 5, "username": "bob",
+               "profile_picture": None, "content": "nice", "created_at": "now"}],
+             app.COMMENT_WEIGHT),
+        ]
+        for url, data, rows, weight in cases:
+            with self.subTest(url=url), \
+                 mock.patch.object(app, "get_db_connection", return_value=conn), \
+                 mock.patch.object(app, "bump_post_score") as bump:
+                cur.fetchone.side_effect = rows
+                self.assertEqual(client.post(url, data=data).status_code, 200)
+                bump.assert_called_once_with(cur, 7, weight)
+
+    def test_bump_follow_counts_adjusts_both_users(self):
+        cur = mock.MagicMock()
+        app.bump_follow_counts(cur, 5, 9, -1)
+        self.assertEqual([c[0][1] for c in cur.execute.call_args_list], [(9, -1, -1), (5, -1, -1)])
+
+    def test_follow_api_toggles_and_counts_only_real_changes(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        cases = [
+            ([1], "unfollowed", -1),      # row deleted
+            ([0, 1], "followed", 1),      # nothing deleted, row inserted
+            ([0, 0], "followed", None),   # concurrent follow already inserted it
+        ]
+        for rowcounts, status, delta in cases:
+            conn = mock.MagicMock()
+            type(conn.cursor.return_value).rowcount = mock.PropertyMock(side_effect=rowcounts)
+            with self.subTest(rowcounts=rowcounts), \
+                 mock.patch.object(app, "get_db_connection", return_value=conn), \
+                 mock.patch.object(app, "get_user_by_username", return_value={"id": 9}), \
+                 mock.patch.object(app, "get_follow_counts", return_value=(1, 0)), \
+                 mock.patch.object(app, "bump_follow_counts") as bump:
+                resp = client.post("/follow_api/bob")
+                self.assertEqual(resp.get_json()["status"], status)
+                if delta is None:
+                    bump.assert_not_called()
+                else:
+                    bump.assert_called_once_with(conn.cursor.return_value, 5, 9, delta)
+
+    def _upload_client(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        return client
+
+    def test_upload_chunk_rejects_wrong_offset_and_oversized_chunk(self):
+        client = self._upload_client()
+        sess = {"id": "u1", "received": 10, "total_size": 100, "status": "open"}
+        with mock.patch.object(app, "_load_upload_session", return_value=sess), \
+             mock.patch.object(app, "get_db_connection") as connect:
+            resp = client.put("/upload_api/u1", data=b"x" * 5, headers={"Upload-Offset": "0"})
+            self.assertEqual(resp.status_code, 409)
+            self.assertEqual(resp.get_json()["offset"], 10)
+
+            with mock.patch.object(app, "UPLOAD_CHUNK_SIZE", 4):
+                resp = client.put("/upload_api/u1", data=b"x" * 5, headers={"Upload-Offset": "10"})
+            self.assertEqual(resp.status_code, 413)
+            connect.assert_not_called()
+
+    def test_finalize_rejects_incomplete_upload(self):
+        client = self._upload_client()
+        sess = {"id": "u1", "received": 10, "total_size": 100, "status": "open"}
+        with mock.patch.object(app, "_load_upload_session", return_value=sess), \
+             mock.patch.object(app, "get_db_connection") as connect, \
+             mock.patch.object(app.shutil, "move") as move:
+            resp = client.post("/upload_api/u1/finalize")
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.get_json()["status"], "open")
+        connect.assert_not_called()
+        move.assert_not_called()
+
+    def test_transcode_renditions_never_upscale(self):
+        for height, expected in [(720, [360, 720]), (240, [360])]:
+            def fake_run(cmd, **kwargs):
+                return subprocess.CompletedProcess(cmd, 0, stdout=f"{height}\n" if cmd[0] == "ffprobe" else "")
+            with self.subTest(height=height), tempfile.TemporaryDirectory() as tmp, \
+                 mock.patch.object(app.subprocess, "run", side_effect=fake_run) as run:
+                out_dir = app.transcode_video("in.mp4", os.path.join(tmp, "in.mp4"))
+                scales = [c[0][0][c[0][0].index("-vf") + 1] for c in run.call_args_list[1:-1]]
+                self.assertEqual(scales, [f"scale=-2:{h}" for h in expected])
+                with open(os.path.join(out_dir, "master.m3u8")) as f:
+                    self.assertEqual([l for l in f.read().split() if l.endswith("p.m3u8")],
+                                     [f"{h}p.m3u8" for h in expected])
+
+    def test_shard_init_upgrades_legacy_messages_before_copying(self):
+        steps = mock.MagicMock()
+        steps._copy_new_rows.return_value = 0
+        with mock.patch.object(app, "SHARD_CONFIG", {"hosts": {}}), \
+             mock.patch.object(app, "LOGICAL_SHARDS", 2), \
+             mock.patch.object(app, "get_db_connection"), \
+             mock.patch.object(app, "table_exists", side_effect=lambda cur, t: t == "messages"), \
+             mock.patch.object(app, "column_exists", return_value=False), \
+             mock.patch.object(app, "get_shard_map", return_value={0: ("a", "active"), 1: ("b", "active")}), \
+             mock.patch.object(app, "create_shard_database"), \
+             mock.patch.object(app, "connect_shard_host"), \
+             mock.patch.object(app, "_migrate_messages_to_owner_copies", steps._migrate), \
+             mock.patch.object(app, "_copy_new_rows", steps._copy_new_rows):
+            app.migrate_unsharded_tables()
+
+        self.assertEqual([c[0] for c in steps.mock_calls], ["_migrate", "_copy_new_rows", "_copy_new_rows"])
+        copy_args = steps._copy_new_rows.call_args_list
+        self.assertEqual([c[0][2] for c in copy_args], ["messages", "messages"])
+        self.assertEqual([c[0][7] for c in copy_args], [(2, 0), (2, 1)])
+        self.assertIn("owner_id", copy_args[0][0][6])
+
+    def test_profile_update_with_unclaimed_upload_is_rejected(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        conn = mock.MagicMock()
+        cur = conn.cursor.return_value
+        cur.fetchone.return_value = {"id": 5, "username": "bob"}
+        with mock.patch.object(app, "get_db_connection", return_value=conn), \
+             mock.patch.object(app, "claim_upload", return_value=None):
+            resp = client.post("/profile", data={"bio": "hi", "upload_id": "abc"})
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse([c for c in cur.execute.call_args_list if c[0][0].startswith("UPDATE")])
+        conn.commit.assert_not_called()
+        with client.session_transaction() as sess:
+            self.assertEqual(sess["_flashes"], [("error", "Upload not found or not finished")])
+
+    def test_reused_video_name_drops_old_hls_and_retranscodes(self):
+        futures = []
+
+        def submit(fn, src, out_dir):
+            futures.append(Future())
+            return futures[-1]
+
+        pool = mock.MagicMock()
+        pool.submit.side_effect = submit
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.object(app, "HLS_FOLDER", tmp), \
+             mock.patch.object(app, "_transcode_pool", pool), \
+             mock.patch.object(app, "_transcoding", {}), \
+             mock.patch.object(app.shutil, "which", return_value="/usr/bin/ffmpeg"):
+            app.enqueue_transcode("clip.mp4")
+            os.makedirs(os.path.join(tmp, "clip.mp4"))
+            open(os.path.join(tmp, "clip.mp4", "master.m3u8"), "w").close()
+
+            app.enqueue_transcode("clip.mp4")  # re-upload while the first job runs
+            self.assertFalse(os.path.exists(os.path.join(tmp, "clip.mp4")))
+            self.assertEqual(len(futures), 1)
+
+            futures[0].set_result(None)
+            self.assertEqual(len(futures), 2)
+            futures[1].set_result(None)
+            self.assertEqual(app._transcoding, {})
+
+    def test_follow_button_keeps_username_out_of_js(self):
+        name = "x');alert(1);//"
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        conn = mock.MagicMock()
+        cur = conn.cursor.return_value
+        cur.fetchone.side_effect = [{"id": 9, "username": name, "profile_picture": None, "bio": ""},
+                                    None, None]
+        cur.fetchall.return_value = []
+        with mock.patch.object(app, "get_db_connection", return_value=conn):
+            page = client.get("/user/x").get_data(as_text=True)
+        self.assertIn('data-username="x&#39;);alert(1);//"', page)
+        self.assertIn('onclick="toggleFollow(this.dataset.username)"', page)
+
+    def test_explore_next_link_only_when_more_posts(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+        for more, shown in ((None, False), ((1,), True)):
+            conn = mock.MagicMock()
+            conn.cursor.return_value.fetchone.return_value = more
+            with self.subTest(more=more), \
+                 mock.patch.object(app, "get_db_connection", return_value=conn), \
+                 mock.patch.object(app, "stream_rows", return_value=iter([])):
+                page = client.get("/explore?page=2").get_data(as_text=True)
+            self.assertEqual("/explore?page=3" in page, shown)
+            self.assertIn("/explore?page=1", page)
+            self.assertEqual(conn.cursor.return_value.execute.call_args[0][1],
+                             (2 * app.EXPLORE_PAGE_SIZE,))
+
+    def test_feed_streams_gzip_with_flash_messages(self):
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 5
+            sess["_flashes"] = [("success", "Welcome back!")]
+        rows = [{"id": i, "user_id": 1, "content": f"post-{i}", "media_filename": None,
+                 "created_at": app.datetime.now(), "username": "bob", "profile_picture": None}
+                for i in range(60)]
+        conn = mock.MagicMock()
+        conn.cursor.return_value.fetchone.return_value = None
+        conn.cursor.return_value.fetchall.return_value = []
+        with mock.patch.object(app, "STREAM_TEMPLATES", True), \
+             mock.patch.object(app, "get_db_connection", return_value=conn), \
+             mock.patch.object(app, "stream_rows", return_value=iter(rows)), \
+             mock.patch.object(app, "like_stats", return_value={}):
+            resp = client.get("/feed", headers={"Accept-Encoding": "gzip"})
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            page = gzip.decompress(resp.get_data()).decode("utf-8")
+            resp.close()
+        self.assertIn("Welcome back!", page)
+        self.assertIn("post-0", page)
+        self.assertIn("post-59", page)
+        # flashes were consumed before streaming, so the cookie no longer carries them
+        with client.session_transaction() as sess:
+            self.assertNotIn("_flashes", sess)
+
 if __name__ == "__main__":
     unittest.main()